@@ -0,0 +1,157 @@
+# approx_eval.py
+"""
+Measures how far approximate runs (mapper --sample-degree) are from the exact
+recommendations, and what they save, on the bundled dataset by default.
+
+Each sample degree gets a full local-backend pipeline run. Every user's top-k
+from its reducers is compared with the exact top-k computed by csr_engine, or
+read from a file written by 'csr_engine.py --with-counts':
+
+    python approx_eval.py --sample-degrees 20 40 60
+
+Reported per run: wall time, map records, shuffle bytes, the relative error
+the job estimated, the mean top-k overlap (share of a user's exact
+recommendations that the approximate list also holds) and the share of users
+whose lists are identical. An exact run is included as the baseline.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+
+from benchmark import PIPELINE_FILES
+from records import FORMATS
+from reducer import rank_recommendations
+
+def parse_recommendations(lines, top_k):
+    """
+    {user: [recommendation, ...]} from reducer-style 'user\\trec:count,...'
+    lines. Lists of the same user on several lines are merged and re-ranked.
+    """
+    candidates = defaultdict(list)
+    for line in lines:
+        user, _, recommendations = line.rstrip('\n').partition('\t')
+        for rec in recommendations.split(','):
+            if rec:
+                candidate, count = rec.split(':')
+                candidates[user].append((candidate, int(count)))
+    return {user: [rec for rec, _ in rank_recommendations(recs, top_k)] for user, recs in candidates.items()}
+
+def exact_recommendations(input_file, top_k):
+    """Exact top_k lists of every user, computed in memory by csr_engine."""
+    from csr_engine import load_adjacency, recommend
+    indptr, indices = load_adjacency(input_file)
+    return {str(user): [str(rec) for rec, _ in recs] for user, recs in recommend(indptr, indices, k=top_k)}
+
+def top_k_overlap(exact, approximate):
+    """
+    Mean share of each user's exact recommendations found in their
+    approximate list, and the share of users whose lists are identical.
+    """
+    users = [user for user, recs in exact.items() if recs]
+    if not users:
+        return 1.0, 1.0
+    overlap = sum(len(set(exact[user]) & set(approximate.get(user, ()))) / len(exact[user]) for user in users)
+    identical = sum(exact[user] == approximate.get(user) for user in users)
+    return overlap / len(users), identical / len(users)
+
+def run_pipeline(input_file, work_dir, sample_degree, args):
+    """Run the local pipeline once and return its measurements and every user's top-k."""
+    pipeline_dir = os.path.join(work_dir, f'pipeline_{sample_degree or "exact"}')
+    os.makedirs(pipeline_dir)
+    for file_name in PIPELINE_FILES:
+        shutil.copy(file_name, pipeline_dir)
+
+    from main_orchestrator import MapReduceOrchestrator
+    cwd = os.getcwd()
+    os.chdir(pipeline_dir)
+    try:
+        orchestrator = MapReduceOrchestrator(
+            input_file, args.mappers, args.reducers, backend='local', record_format=args.format,
+            vectorized=args.vectorized, top_k=args.top_k, workers_per_node=args.workers,
+            sample_degree=sample_degree, report_file=None
+        )
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            orchestrator.run_mapreduce()
+            seconds = time.perf_counter() - start
+            lines = []
+            for i, instance in enumerate(orchestrator.reduce_placement):
+                with orchestrator.data_processor.open_task_output(instance, f'reducer_output_{i}.txt') as f:
+                    lines.extend(io.TextIOWrapper(f))
+            orchestrator.cleanup()
+    finally:
+        os.chdir(cwd)
+
+    phases = orchestrator.report.phases
+    collect = phases.get('collect', {}).get('instances', {})
+    return {
+        'sample_degree': sample_degree,
+        'seconds': round(seconds, 4),
+        'map_records': phases['map'].get('records_emitted'),
+        'shuffle_bytes': sum(entry.get('bytes', 0) for entry in collect.values()),
+        'estimated_relative_error': phases['reduce'].get('estimated_relative_error'),
+    }, parse_recommendations(lines, args.top_k)
+
+def run_evaluation(args):
+    input_file = os.path.abspath(args.input)
+    if args.exact:
+        with open(args.exact) as f:
+            exact = parse_recommendations(f, args.top_k)
+    else:
+        exact = exact_recommendations(input_file, args.top_k)
+
+    work_dir = tempfile.mkdtemp(prefix='approx_eval_')
+    try:
+        runs = []
+        for sample_degree in ([] if args.skip_baseline else [None]) + args.sample_degrees:
+            result, approximate = run_pipeline(input_file, work_dir, sample_degree, args)
+            overlap, identical = top_k_overlap(exact, approximate)
+            result['top_k_overlap'] = round(overlap, 4)
+            result['identical_lists'] = round(identical, 4)
+            runs.append(result)
+        return {
+            'input': args.input,
+            'users': sum(1 for recs in exact.values() if recs),
+            'config': {
+                'top_k': args.top_k,
+                'format': args.format,
+                'vectorized': args.vectorized,
+                'workers': args.workers,
+                'mappers': args.mappers,
+                'reducers': args.reducers,
+            },
+            'runs': runs,
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compare approximate recommendations with exact ones')
+    parser.add_argument('--input', default='soc-LiveJournal1Adj.txt', help='Adjacency list input file')
+    parser.add_argument('--sample-degrees', type=int, nargs='+', default=[20, 40, 60],
+                        help='Sample degrees to evaluate')
+    parser.add_argument('--exact', help='Exact results written by csr_engine.py --with-counts (default: compute them)')
+    parser.add_argument('--top-k', type=int, default=10, help='Recommendations compared per user')
+    parser.add_argument('--format', choices=FORMATS, default='text', help='Intermediate record format')
+    parser.add_argument('--vectorized', action='store_true', help='Use the NumPy mapper (binary format only)')
+    parser.add_argument('--workers', type=int, default=1, help='Processes per mapper and reducer')
+    parser.add_argument('--mappers', type=int, default=3, help='Mappers per run')
+    parser.add_argument('--reducers', type=int, default=2, help='Reducers per run')
+    parser.add_argument('--skip-baseline', action='store_true', help='Skip the exact pipeline run')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run_evaluation(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
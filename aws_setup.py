@@ -3,12 +3,15 @@ import os
 from botocore.exceptions import ClientError
 
 class AWSResourceManager:
-    def __init__(self, key_name='mapreduce-key', security_group_name='mapreduce-sg', bucket_name='mapreduce-socialnetwork'):
+    def __init__(self, key_name='mapreduce-key', security_group_name='mapreduce-sg', bucket_name='mapreduce-socialnetwork',
+                 instance_profile=None):
         self.ec2_client = boto3.client('ec2', region_name='us-east-1')
         self.s3_client = boto3.client('s3')
         self.key_name = key_name
         self.security_group_name = security_group_name
         self.bucket_name = bucket_name
+        # Optional IAM instance profile, e.g. one granting workers access to the bucket
+        self.instance_profile = instance_profile
         
     def setup_aws_resources(self):
         """Setup required AWS resources"""
@@ -21,7 +24,8 @@ class AWSResourceManager:
             'key_name': self.key_name,
             'security_group_id': self.security_group_id,
             'image_id': self.image_id,
-            'vpc_id': self.vpc_id
+            'vpc_id': self.vpc_id,
+            'instance_profile': self.instance_profile
         }
 
     def create_key_pair(self):
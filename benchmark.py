@@ -0,0 +1,244 @@
+# benchmark.py
+"""
+Benchmarks the mapper, the shuffle, the reducer and the full local pipeline
+on synthetic graphs, and writes the measurements as JSON.
+
+    python benchmark.py --nodes 20000 --avg-degree 20 --graph powerlaw --hub-degree 2000
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from data_processor import DataProcessor
+from records import FORMATS, PARTITION_MODES, RECORD_SIZE, read_records
+
+# Files the local pipeline benchmark copies next to its input
+PIPELINE_FILES = ['main_orchestrator.py', 'data_processor.py', 'local_backend.py',
+                  'mapper.py', 'reducer.py', 'records.py', 'run_report.py', 'shuffle.py',
+                  'graph_store.py', 'scheduler.py', 'intra_node.py', 'checkpoint.py']
+
+def generate_graph(n_nodes, avg_degree, graph='uniform', hub_degree=None, n_hubs=0, seed=0):
+    """
+    Generate an undirected random graph as {user: set(friends)}.
+    uniform:  edges between uniformly chosen endpoints.
+    powerlaw: Chung-Lu style graph whose expected degrees follow a power law
+              (exponent ~2.5), scaled to avg_degree and capped at hub_degree.
+    n_hubs extra nodes are then connected to hub_degree random users each.
+    """
+    rng = random.Random(seed)
+    adjacency = {user: set() for user in range(n_nodes)}
+    n_edges = n_nodes * avg_degree // 2
+
+    if graph == 'uniform':
+        endpoints = [rng.randrange(n_nodes) for _ in range(2 * n_edges)]
+    elif graph == 'powerlaw':
+        weights = [(user + 1) ** -0.67 for user in range(n_nodes)]
+        scale = n_nodes * avg_degree / sum(weights)
+        cap = hub_degree or n_nodes - 1
+        weights = [min(weight * scale, cap) for weight in weights]
+        endpoints = rng.choices(range(n_nodes), weights=weights, k=2 * n_edges)
+    else:
+        raise ValueError(f"Unknown graph type: {graph}")
+
+    for a, b in zip(endpoints[::2], endpoints[1::2]):
+        if a != b:
+            adjacency[a].add(b)
+            adjacency[b].add(a)
+
+    for hub in rng.sample(range(n_nodes), min(n_hubs, n_nodes)):
+        for friend in rng.sample(range(n_nodes), min(hub_degree or 0, n_nodes)):
+            if friend != hub:
+                adjacency[hub].add(friend)
+                adjacency[friend].add(hub)
+    return adjacency
+
+def write_adjacency(adjacency, path):
+    """Write a graph in the soc-LiveJournal1Adj.txt format."""
+    with open(path, 'w') as f:
+        for user in sorted(adjacency):
+            friends = ','.join(str(friend) for friend in sorted(adjacency[user]))
+            f.write(f"{user}\t{friends}\n")
+
+def count_records(path, fmt):
+    if fmt == 'binary':
+        return os.path.getsize(path) // RECORD_SIZE
+    with open(path, 'rb') as f:
+        return sum(1 for _ in f)
+
+def measurement(stage, seconds, records_in, records_out, bytes_in, bytes_out, lines_in=None):
+    """
+    Build one result entry with derived throughput figures. records_per_sec
+    counts intermediate records read, or written by stages that read
+    adjacency lines instead (lines_in), so every stage uses the same unit.
+    """
+    records = records_in if records_in is not None else records_out
+    result = {
+        'stage': stage,
+        'seconds': round(seconds, 4),
+        'records_in': records_in,
+        'records_out': records_out,
+        'bytes_in': bytes_in,
+        'bytes_out': bytes_out,
+        'records_per_sec': round(records / seconds, 1) if seconds and records is not None else None,
+        'bytes_per_sec': round(bytes_in / seconds, 1) if seconds else None,
+    }
+    if lines_in is not None:
+        result['lines_in'] = lines_in
+        result['lines_per_sec'] = round(lines_in / seconds, 1) if seconds else None
+    return result
+
+def run_script(script, args, input_path, output_path):
+    """Run a worker script the way a worker would and return the wall time."""
+    start = time.perf_counter()
+    with open(input_path, 'rb') as stdin, open(output_path, 'wb') as stdout:
+        subprocess.run([sys.executable, script] + args, stdin=stdin, stdout=stdout, check=True)
+    return time.perf_counter() - start
+
+def bench_mapper(graph_file, work_dir, mapper_args, fmt):
+    output = os.path.join(work_dir, 'mapper_output_0.txt')
+    seconds = run_script(os.path.abspath('mapper.py'), mapper_args, graph_file, output)
+    with open(graph_file, 'rb') as f:
+        lines = sum(1 for _ in f)
+    result = measurement('map', seconds, None, count_records(output, fmt),
+                         os.path.getsize(graph_file), os.path.getsize(output), lines_in=lines)
+    return result, output
+
+def bench_partition(mapper_output, work_dir, fmt, n_reducers, memory_budget, mode='pair'):
+    processor = DataProcessor(None, fmt, memory_budget, temp_dir=work_dir)
+    start = time.perf_counter()
+    with open(mapper_output, 'rb') as f:
+        partition_files = processor.partition_mapper_outputs(read_records(f, fmt), n_reducers, mode)
+    seconds = time.perf_counter() - start
+    records = count_records(mapper_output, fmt)
+    bytes_out = sum(os.path.getsize(path) for path in partition_files)
+    return measurement('partition', seconds, records, records,
+                       os.path.getsize(mapper_output), bytes_out), partition_files
+
+def bench_reducer(partition_file, work_dir, reducer_args, fmt):
+    output = os.path.join(work_dir, 'reducer_output_0.txt')
+    seconds = run_script(os.path.abspath('reducer.py'), reducer_args, partition_file, output)
+    return measurement('reduce', seconds, count_records(partition_file, fmt), count_records(output, 'text'),
+                       os.path.getsize(partition_file), os.path.getsize(output))
+
+def bench_pipeline(graph_file, work_dir, args):
+    """Time a full local-backend run of MapReduceOrchestrator."""
+    pipeline_dir = os.path.join(work_dir, 'pipeline')
+    os.makedirs(pipeline_dir, exist_ok=True)
+    for file_name in PIPELINE_FILES:
+        shutil.copy(file_name, pipeline_dir)
+
+    from main_orchestrator import MapReduceOrchestrator
+    cwd = os.getcwd()
+    os.chdir(pipeline_dir)
+    try:
+        orchestrator = MapReduceOrchestrator(
+            graph_file, args.mappers, args.reducers, backend='local',
+            combine=args.combine, record_format=args.format,
+            shuffle_memory_budget=args.memory_budget, streaming_reducer=args.streaming_reducer,
+            partition_mode=args.partition_mode, vectorized=args.vectorized, workers_per_node=args.workers
+        )
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            orchestrator.run_mapreduce()
+            seconds = time.perf_counter() - start
+            orchestrator.cleanup()
+    finally:
+        os.chdir(cwd)
+    with open(graph_file, 'rb') as f:
+        lines = sum(1 for _ in f)
+    return measurement('pipeline', seconds, None, None, os.path.getsize(graph_file), None, lines_in=lines)
+
+def run_benchmark(args):
+    work_dir = tempfile.mkdtemp(prefix='benchmark_')
+    try:
+        adjacency = generate_graph(args.nodes, args.avg_degree, args.graph, args.hub_degree, args.hubs, args.seed)
+        graph_file = os.path.join(work_dir, 'graph.txt')
+        write_adjacency(adjacency, graph_file)
+        degrees = [len(friends) for friends in adjacency.values()]
+
+        mapper_args = ['--format', args.format, '--workers', str(args.workers)] + (['--combine'] if args.combine else [])
+        if args.vectorized:
+            mapper_args.append('--vectorized')
+        reducer_args = ['--format', args.format, '--workers', str(args.workers)] + (['--streaming'] if args.streaming_reducer else [])
+        if args.partition_mode == 'user':
+            reducer_args += ['--partition', '0', '--n-partitions', str(args.reducers)]
+
+        results = []
+        for _ in range(args.repeat):
+            map_result, mapper_output = bench_mapper(graph_file, work_dir, mapper_args, args.format)
+            partition_result, partition_files = bench_partition(mapper_output, work_dir, args.format,
+                                                                args.reducers, args.memory_budget,
+                                                                args.partition_mode)
+            reduce_result = bench_reducer(partition_files[0], work_dir, reducer_args, args.format)
+            results.extend([map_result, partition_result, reduce_result])
+            if not args.skip_pipeline:
+                results.append(bench_pipeline(graph_file, work_dir, args))
+            for path in partition_files:
+                os.remove(path)
+
+        return {
+            'graph': {
+                'type': args.graph,
+                'nodes': args.nodes,
+                'edges': sum(degrees) // 2,
+                'avg_degree': round(sum(degrees) / max(len(degrees), 1), 2),
+                'max_degree': max(degrees, default=0),
+                'pair_work': sum(d * (d - 1) // 2 for d in degrees),
+                'seed': args.seed,
+            },
+            'config': {
+                'format': args.format,
+                'combine': args.combine,
+                'vectorized': args.vectorized,
+                'workers': args.workers,
+                'streaming_reducer': args.streaming_reducer,
+                'mappers': args.mappers,
+                'reducers': args.reducers,
+                'memory_budget': args.memory_budget,
+                'partition_mode': args.partition_mode,
+            },
+            'results': results,
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the friend recommendation pipeline')
+    parser.add_argument('--graph', choices=['uniform', 'powerlaw'], default='powerlaw', help='Graph generator')
+    parser.add_argument('--nodes', type=int, default=10000, help='Number of users')
+    parser.add_argument('--avg-degree', type=int, default=20, help='Average number of friends')
+    parser.add_argument('--hub-degree', type=int, default=1000,
+                        help='Degree cap for powerlaw graphs and degree of each extra hub')
+    parser.add_argument('--hubs', type=int, default=0, help='Extra hub users added to the graph')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--format', choices=FORMATS, default='text', help='Intermediate record format')
+    parser.add_argument('--combine', action='store_true', help='Use the combining mapper')
+    parser.add_argument('--vectorized', action='store_true', help='Use the NumPy mapper (binary format only)')
+    parser.add_argument('--streaming-reducer', action='store_true', help='Use the top-k heap reducer')
+    parser.add_argument('--partition-mode', choices=PARTITION_MODES, default='pair',
+                        help='Route shuffle records by pair or by user')
+    parser.add_argument('--workers', type=int, default=1, help='Processes per mapper and reducer')
+    parser.add_argument('--mappers', type=int, default=3, help='Mappers for the pipeline run')
+    parser.add_argument('--reducers', type=int, default=2, help='Reducers for the shuffle and pipeline runs')
+    parser.add_argument('--memory-budget', type=int, default=500000, help='Shuffle memory budget in records')
+    parser.add_argument('--repeat', type=int, default=1, help='Number of repetitions')
+    parser.add_argument('--skip-pipeline', action='store_true', help='Skip the end-to-end run')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run_benchmark(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
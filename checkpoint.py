@@ -0,0 +1,128 @@
+# checkpoint.py
+"""
+Content-addressed checkpoints of the orchestrator's phase outputs.
+
+Every map task output, reducer partition and reduce task output is saved
+under a key that hashes everything it was computed from: the worker code,
+the bytes of the task's input, and the options that change the output.
+
+    map/<hash>        code, split contents, mapper options
+    partition/<hash>  the map keys of every split, shuffle options, partition index
+    reduce/<hash>     partition key, reducer options
+
+The orchestrator works out every key before launching anything and only
+runs the tasks whose key is missing, so a rerun after a failure resumes
+from the first missing output, an unchanged split is never mapped twice,
+and a rerun with a different reducer count reuses the map outputs.
+Checkpoints live in a directory or under an S3 prefix, addressed like a
+shuffle store (see shuffle.open_store), and are never cleared by a job.
+"""
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import tempfile
+from array import array
+
+from shuffle import open_store
+
+HASH_CHUNK = 16 * 1024 * 1024
+
+def digest(*parts):
+    """Hash JSON-serializable parts into a hex key."""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(json.dumps(part, sort_keys=True).encode())
+        h.update(b'\0')
+    return h.hexdigest()
+
+def code_version(files):
+    """Hash of the worker source files, so a code change invalidates every checkpoint."""
+    h = hashlib.sha256()
+    for name in sorted(set(files)):
+        h.update(name.encode() + b'\0')
+        with open(name, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+def range_digest(path, start, end):
+    """Hash of bytes [start, end) of a file."""
+    h = hashlib.sha256()
+    if end > start:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            for pos in range(start, end, HASH_CHUNK):
+                h.update(m[pos:min(pos + HASH_CHUNK, end)])
+    return h.hexdigest()
+
+def pieces_digest(path, pieces):
+    """Hash of a cost-based split: its byte ranges of a file, and the rows of each hub shard."""
+    h = hashlib.sha256()
+    if not pieces:
+        return h.hexdigest()
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        for piece in pieces:
+            start, end = piece[:2]
+            for pos in range(start, end, HASH_CHUNK):
+                h.update(m[pos:min(pos + HASH_CHUNK, end)])
+            if len(piece) == 4:
+                h.update(f'\0{piece[2]}:{piece[3]}\0'.encode())
+    return h.hexdigest()
+
+def graph_rows_digest(store_path, rows):
+    """Hash of the users and friend lists in rows [start, end) of a graph store."""
+    from graph_store import GraphStore
+    start, end = rows
+    h = hashlib.sha256()
+    with GraphStore(store_path) as store:
+        end = min(end, store.n_rows)
+        start = min(start, end)
+        h.update(f'{store.first_row + start}:{store.first_row + end}\0'.encode())
+        # Rebase offsets so the hash does not depend on where the rows sit in the store
+        first = store.offsets[start]
+        with store.offsets[start:end + 1] as window:
+            h.update(array('q', (offset - first for offset in window)).tobytes())
+        with store.neighbors[first - store.base:store.offsets[end] - store.base] as neighbors:
+            h.update(neighbors)
+    return h.hexdigest()
+
+class LocalCopy:
+    """Stands in for the instance holding a task's output when the output is a file on this host."""
+
+    id = 'checkpoint'
+
+    def __init__(self, path):
+        self.path = path
+
+class CheckpointStore:
+    """Checkpoint objects in a store, with local copies of the ones this run reads."""
+
+    def __init__(self, url):
+        # A bare bucket gets its own prefix, away from the shuffle store's
+        if url.startswith('s3://') and '/' not in url[len('s3://'):].strip('/'):
+            url = url.rstrip('/') + '/checkpoints'
+        self.url = url
+        self.store = open_store(url)
+        self.local_dir = tempfile.mkdtemp(prefix='checkpoints_')
+        self.hits = 0
+        self.saved = 0
+
+    def has(self, key):
+        return self.store.exists(key)
+
+    def fetch(self, key, name):
+        """Copy a checkpoint to this host and return it as a LocalCopy."""
+        path = os.path.join(self.local_dir, name)
+        self.store.get(key, path)
+        self.hits += 1
+        return LocalCopy(path)
+
+    def save(self, local_path, key):
+        self.store.put(local_path, key)
+        self.saved += 1
+
+    def local_path(self, name):
+        return os.path.join(self.local_dir, name)
+
+    def close(self):
+        shutil.rmtree(self.local_dir, ignore_errors=True)
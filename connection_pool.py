@@ -0,0 +1,126 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import paramiko
+
+class SSHConnectionPool:
+    """
+    Keeps one SSH connection and one SFTP session per instance for the whole job.
+    Shared by InstanceManager and DataProcessor so every node pays the key load
+    and SSH handshake once. Dropped connections are detected and reopened.
+    An SFTP session cannot be used by two threads at once, so transfers to
+    the same instance take turns through sftp_session().
+    """
+
+    def __init__(self, key_name, username='ubuntu', connect_retries=3, retry_interval=30):
+        self.key_file = f"{key_name}.pem"
+        self.username = username
+        self.connect_retries = connect_retries
+        self.retry_interval = retry_interval
+        self._key = None
+        self._connections = {}
+        self._instance_locks = {}
+        self._sftp_locks = {}
+        self._lock = threading.Lock()
+
+    def _get_key(self):
+        """Load the private key once"""
+        with self._lock:
+            if self._key is None:
+                self._key = paramiko.RSAKey.from_private_key_file(self.key_file)
+            return self._key
+
+    def _instance_lock(self, instance):
+        with self._lock:
+            return self._instance_locks.setdefault(instance.id, threading.RLock())
+
+    def _sftp_lock(self, instance):
+        with self._lock:
+            return self._sftp_locks.setdefault(instance.id, threading.RLock())
+
+    def _connect(self, instance):
+        """Open a new SSH connection, retrying while the instance boots"""
+        key = self._get_key()
+        for attempt in range(self.connect_retries):
+            ssh = paramiko.SSHClient()
+            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            try:
+                ssh.connect(hostname=instance.public_ip_address, username=self.username, pkey=key)
+                return ssh
+            except Exception:
+                ssh.close()
+                if attempt == self.connect_retries - 1:
+                    raise
+                time.sleep(self.retry_interval)
+
+    @staticmethod
+    def _is_alive(ssh):
+        """Check that the connection's transport is still usable"""
+        transport = ssh.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        try:
+            transport.send_ignore()
+            return True
+        except Exception:
+            return False
+
+    def get_client(self, instance):
+        """Return a live SSHClient for the instance, reconnecting if needed"""
+        with self._instance_lock(instance):
+            connection = self._connections.get(instance.id)
+            if connection and self._is_alive(connection['ssh']):
+                return connection['ssh']
+            self.close(instance)
+            ssh = self._connect(instance)
+            self._connections[instance.id] = {'ssh': ssh, 'sftp': None}
+            return ssh
+
+    @contextmanager
+    def sftp_session(self, instance):
+        """
+        Use the instance's SFTP session for a whole transfer. Other threads
+        transferring to the same instance wait until the block ends; commands
+        run over the SSH connection meanwhile.
+        """
+        with self._sftp_lock(instance):
+            yield self.get_sftp(instance)
+
+    def get_sftp(self, instance):
+        """
+        Return the instance's SFTP session, reopening it if its connection dropped.
+        Use sftp_session() when other threads may transfer to the instance.
+        """
+        with self._instance_lock(instance):
+            self.get_client(instance)
+            connection = self._connections[instance.id]
+            sftp = connection['sftp']
+            if sftp is None or sftp.get_channel().closed:
+                sftp = connection['ssh'].open_sftp()
+                connection['sftp'] = sftp
+            return sftp
+
+    @staticmethod
+    def _close_connection(connection):
+        try:
+            if connection['sftp'] is not None:
+                connection['sftp'].close()
+            connection['ssh'].close()
+        except Exception:
+            pass
+
+    def close(self, instance):
+        """Close the connection to one instance"""
+        with self._instance_lock(instance):
+            connection = self._connections.pop(instance.id, None)
+            if connection is not None:
+                self._close_connection(connection)
+
+    def close_all(self):
+        """Close every pooled connection"""
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for connection in connections:
+            self._close_connection(connection)
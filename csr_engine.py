@@ -0,0 +1,169 @@
+# csr_engine.py
+"""
+Single-node recommendation engine for graphs that fit in memory.
+
+The adjacency list is loaded into NumPy CSR arrays and mutual friend counts
+are computed row by row as (A^T A)[u], masked by the user's direct friends
+and by u itself. For the symmetric LiveJournal graph this is A.A masked by A
+and the diagonal. It gives the same answers as mapper.py + reducer.py and
+serves as a fast baseline and correctness oracle for the distributed path.
+"""
+import argparse
+import numpy as np
+
+def load_adjacency(input_file):
+    """
+    Parse an adjacency list file into CSR arrays indexed by user ID.
+    Returns (indptr, indices); duplicate friends within a line are dropped.
+    """
+    rows = {}
+    with open(input_file, 'r') as f:
+        for line in f:
+            parts = line.strip().split('\t')
+            if len(parts) != 2:
+                continue
+            friends = [friend for friend in parts[1].split(',') if friend]
+            if friends:
+                rows[int(parts[0])] = np.unique(np.array(friends, dtype=np.int64))
+    return build_csr(rows)
+
+def load_graph_store(input_file):
+    """
+    CSR arrays from the cached binary graph store of input_file (built on
+    first use, see graph_store.py). Neighbors are read in place from the
+    mapping when every row is already sorted and unique; otherwise rows are
+    sorted and de-duplicated to match load_adjacency.
+    """
+    from graph_store import GraphStore, ensure_graph_store
+    store = GraphStore(ensure_graph_store(input_file))
+    indptr = np.frombuffer(store.offsets, dtype=np.int32).astype(np.int64) - store.base
+    indices = np.frombuffer(store.neighbors, dtype=np.int32)
+    n_rows = store.n_rows
+
+    if not store.sorted_unique:
+        rows = np.repeat(np.arange(n_rows, dtype=np.int64), np.diff(indptr))
+        order = np.lexsort((indices, rows))
+        rows, indices = rows[order], indices[order]
+        keep = np.ones(len(indices), dtype=bool)
+        keep[1:] = (rows[1:] != rows[:-1]) | (indices[1:] != indices[:-1])
+        rows, indices = rows[keep], indices[keep]
+        np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+
+    # Users that only appear in friend lists get empty rows, as in build_csr
+    n_nodes = max(n_rows, int(indices.max()) + 1 if len(indices) else 0)
+    if n_nodes > n_rows:
+        indptr = np.concatenate((indptr, np.full(n_nodes - n_rows, indptr[-1])))
+    return indptr, indices
+
+def build_csr(rows):
+    """Build (indptr, indices) from a {user: sorted unique friend array} mapping."""
+    max_id = max((max(user, int(friends[-1])) for user, friends in rows.items()), default=-1)
+    n_nodes = max_id + 1
+    degrees = np.zeros(n_nodes, dtype=np.int64)
+    for user, friends in rows.items():
+        degrees[user] = len(friends)
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(degrees, out=indptr[1:])
+    indices = np.empty(indptr[-1], dtype=np.int64)
+    for user, friends in rows.items():
+        indices[indptr[user]:indptr[user + 1]] = friends
+    return indptr, indices
+
+def transpose_csr(indptr, indices):
+    """Return the CSR arrays of the transposed adjacency (who lists each user)."""
+    n_nodes = len(indptr) - 1
+    sources = np.repeat(np.arange(n_nodes, dtype=np.int64), np.diff(indptr))
+    order = np.argsort(indices, kind='stable')
+    counts = np.bincount(indices, minlength=n_nodes)
+    t_indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(counts, out=t_indptr[1:])
+    return t_indptr, sources[order]
+
+def gather_rows(indptr, indices, rows):
+    """Concatenate the neighbor lists of the given rows without a Python loop."""
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return indices[:0]
+    shifts = starts - (np.cumsum(lengths) - lengths)
+    return indices[np.repeat(shifts, lengths) + np.arange(total)]
+
+def top_k(candidates, counts, k, n_nodes):
+    """
+    Pick the k best candidates: count descending, then ID ascending.
+    Both orders are folded into one int64 score so argpartition can be used.
+    """
+    score = counts * n_nodes + (n_nodes - 1 - candidates)
+    if len(score) > k:
+        best = np.argpartition(-score, k - 1)[:k]
+    else:
+        best = np.arange(len(score))
+    best = best[np.argsort(-score[best])]
+    return candidates[best], counts[best]
+
+def rank_candidates(two_hop, direct, k, n_nodes):
+    """
+    Count each user in two_hop and return the best k that are not in direct,
+    as (recommendation, mutual friend count) pairs.
+    """
+    if len(two_hop) == 0:
+        return []
+    candidates, counts = np.unique(two_hop, return_counts=True)
+    keep = ~np.isin(candidates, direct)
+    candidates, counts = candidates[keep], counts[keep]
+    if len(candidates) == 0:
+        return []
+    # IDs beyond the graph can appear once edges are added at run time
+    n_nodes = max(n_nodes, int(candidates[-1]) + 1)
+    best, best_counts = top_k(candidates, counts, k, n_nodes)
+    return list(zip(best.tolist(), best_counts.tolist()))
+
+def recommend(indptr, indices, users=None, k=10):
+    """Yield (user, [(recommendation, mutual friend count), ...]) for each user."""
+    n_nodes = len(indptr) - 1
+    t_indptr, t_indices = transpose_csr(indptr, indices)
+    if users is None:
+        users = range(n_nodes)
+    for user in users:
+        if user < 0 or user >= n_nodes:
+            continue
+        # Lists that contain the user; each one makes its other members candidates
+        containing = t_indices[t_indptr[user]:t_indptr[user + 1]]
+        two_hop = gather_rows(indptr, indices, containing)
+
+        # Mask out the user and everyone directly connected in either direction
+        direct = np.concatenate((indices[indptr[user]:indptr[user + 1]], containing, [user]))
+        recommendations = rank_candidates(two_hop, direct, k, n_nodes)
+        if recommendations:
+            yield user, recommendations
+
+def write_recommendations(results, output_file, with_counts=False):
+    """
+    Write results as final_recommendations.txt lines ('user rec1,rec2,...'),
+    or as reducer output lines ('user\\trec:count,...') when with_counts is set.
+    """
+    with open(output_file, 'w') as f:
+        for user, recommendations in results:
+            if with_counts:
+                f.write(f"{user}\t{','.join(f'{rec}:{count}' for rec, count in recommendations)}\n")
+            else:
+                f.write(f"{user} {','.join(str(rec) for rec, _ in recommendations)}\n")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Single-node NumPy recommendation engine')
+    parser.add_argument('--input', default='soc-LiveJournal1Adj.txt', help='Adjacency list input file')
+    parser.add_argument('--output', default='final_recommendations.txt', help='Output file')
+    parser.add_argument('--users', help='Comma-separated users to recommend for (default: all)')
+    parser.add_argument('--top-k', type=int, default=10, help='Recommendations per user')
+    parser.add_argument('--graph-store', action='store_true',
+                        help='Load the cached binary CSR copy of the input instead of parsing it')
+    parser.add_argument('--with-counts', action='store_true',
+                        help='Write reducer-style output with mutual friend counts')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    indptr, indices = load_graph_store(args.input) if args.graph_store else load_adjacency(args.input)
+    users = [int(user) for user in args.users.split(',')] if args.users else None
+    write_recommendations(recommend(indptr, indices, users, args.top_k), args.output, args.with_counts)
@@ -1,95 +1,343 @@
-import paramiko
+import mmap
+import os
+import shutil
+import threading
 from collections import defaultdict
+from contextlib import contextmanager
+
+from checkpoint import LocalCopy
+from records import read_records, wrap_stream, write_query_file
+from shuffle import PartitionWriter
+
+# Bytes scanned or uploaded at a time when splitting by byte range
+SCAN_CHUNK = 16 * 1024 * 1024
+UPLOAD_CHUNK = 1024 * 1024
+
+# Users written to final_recommendations.txt when no targets are given
+DEFAULT_TARGET_USERS = ['924', '8941', '8942', '9019', '9020', '9021', '9022', '9990', '9992', '9993']
 
 class DataProcessor:
-    def __init__(self, key_name):
+    # Workers cannot see this host's disk, so byte ranges of the input are uploaded
+    reads_input_directly = False
+
+    def __init__(self, key_name, record_format='text', memory_budget=500000, temp_dir=None,
+                 connection_pool=None, codec='none', compression_level=None):
         self.key_name = key_name
+        if connection_pool is None and key_name is not None:
+            from connection_pool import SSHConnectionPool
+            connection_pool = SSHConnectionPool(key_name)
+        self.connection_pool = connection_pool
+        self.record_format = record_format
+        # Number of intermediate records the shuffle may hold in memory
+        self.memory_budget = memory_budget
+        self.temp_dir = temp_dir
+        # Compression of every file sent to or fetched from a worker
+        self.codec = codec
+        self.compression_level = compression_level
+        # Bytes moved per phase and instance, and shuffle counters, for the run report
+        self.bytes_transferred = defaultdict(lambda: defaultdict(int))
+        self._bytes_lock = threading.Lock()
+        self.shuffle_stats = {}
 
-    def split_input_file(self, input_file, n_mappers):
-        """Split input file for mappers"""
-        with open(input_file, 'r') as f:
-            lines = f.readlines()
-        
-        lines_per_split = len(lines) // n_mappers + 1
-        splits = []
-        
-        for i in range(0, len(lines), lines_per_split):
-            splits.append(lines[i:i + lines_per_split])
-        
+    def _count_bytes(self, phase, instance, n_bytes):
+        """Add to bytes_transferred; transfers to different instances run on several threads."""
+        with self._bytes_lock:
+            self.bytes_transferred[phase][instance.id] += n_bytes
+
+    @contextmanager
+    def open_worker_file(self, instance, filename, mode='r'):
+        """Open a file in the worker's home directory; other transfers to the instance wait until it is closed."""
+        with self.connection_pool.sftp_session(instance) as sftp:
+            with sftp.file(f'/home/ubuntu/{filename}', mode) as f:
+                # Don't wait for the server to acknowledge every write
+                f.set_pipelined('w' in mode)
+                yield f
+
+    @contextmanager
+    def open_task_output(self, source, filename):
+        """Open a task's output file on the instance that wrote it, or its local checkpoint copy."""
+        if isinstance(source, LocalCopy):
+            with open(source.path, 'rb') as f:
+                yield f
+        else:
+            with self.open_worker_file(source, filename, 'rb') as f:
+                yield f
+
+    def fetch_worker_file(self, instance, filename, local_path, phase='collect'):
+        """Download a worker file to this host."""
+        with self.open_worker_file(instance, filename, 'rb') as src, open(local_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, UPLOAD_CHUNK)
+            self._count_bytes(phase, instance, dst.tell())
+
+    def put_worker_file(self, instance, local_path, filename):
+        """Upload a local file to the worker's home directory."""
+        with self.connection_pool.sftp_session(instance) as sftp:
+            sftp.put(local_path, f'/home/ubuntu/{filename}')
+            sftp.chmod(f'/home/ubuntu/{filename}', 0o755)
+
+    def split_ranges(self, input_file, n_mappers, strategy='lines'):
+        """
+        Split input file for mappers into (start, end) byte ranges aligned to
+        line starts. 'lines' gives every mapper the same number of lines,
+        'bytes' the same number of bytes. The file is scanned through mmap and
+        never read into Python strings, so memory stays flat as it grows.
+        """
+        size = os.path.getsize(input_file)
+        if size == 0:
+            return [(0, 0)] * n_mappers
+        with open(input_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            if strategy == 'bytes':
+                cuts = [self._line_start(m, size * k // n_mappers) for k in range(1, n_mappers)]
+            elif strategy == 'lines':
+                cuts = self._line_cuts(m, n_mappers)
+            else:
+                raise ValueError(f"Unknown split strategy: {strategy}")
+        bounds = [0] + cuts + [size]
+        return list(zip(bounds, bounds[1:]))
+
+    @staticmethod
+    def _line_start(m, pos):
+        """Offset of the first line starting at or after pos."""
+        if pos == 0:
+            return 0
+        newline = m.find(b'\n', pos - 1)
+        return len(m) if newline == -1 else newline + 1
+
+    @staticmethod
+    def _line_cuts(m, n_mappers):
+        """Offsets of the lines each mapper after the first starts at, for equal line counts."""
+        size = len(m)
+        n_lines = sum(m[pos:pos + SCAN_CHUNK].count(b'\n') for pos in range(0, size, SCAN_CHUNK))
+        if m[size - 1:] != b'\n':
+            n_lines += 1
+        # Same boundaries as slicing readlines() into chunks of lines_per_split
+        lines_per_split = n_lines // n_mappers + 1
+
+        cuts = []
+        pos = 0
+        lines_before = 0
+        for k in range(1, n_mappers):
+            target = k * lines_per_split
+            # Skip whole chunks, then walk the remaining lines one by one
+            while pos < size:
+                chunk_lines = m[pos:pos + SCAN_CHUNK].count(b'\n')
+                if lines_before + chunk_lines >= target:
+                    break
+                lines_before += chunk_lines
+                pos += SCAN_CHUNK
+            while lines_before < target and pos < size:
+                newline = m.find(b'\n', pos)
+                pos = size if newline == -1 else newline + 1
+                lines_before += 1
+            cuts.append(min(pos, size))
+        return cuts
+
+    def send_split_range(self, instance, input_file, byte_range, filename):
+        """
+        Stream one byte range of the input straight into a worker file,
+        compressed with the job's codec, without an intermediate local copy.
+        """
+        self.send_split_pieces(instance, input_file, [byte_range], filename)
+
+    def send_split_pieces(self, instance, input_file, pieces, filename):
+        """
+        Stream the pieces of a split (see split_by_cost) into a worker file,
+        compressed with the job's codec: byte ranges are copied as they are,
+        hub shards are written as their line with a 'lo:hi' column added.
+        """
+        with open(input_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            view = memoryview(m)
+            try:
+                with self.open_worker_file(instance, filename, 'wb') as out:
+                    stream = wrap_stream(out, 'wb', self.codec, self.compression_level)
+                    for piece in pieces:
+                        start, end = piece[:2]
+                        if len(piece) == 4:
+                            stream.write(self.shard_line(m[start:end], *piece[2:]))
+                            continue
+                        for pos in range(start, end, UPLOAD_CHUNK):
+                            stream.write(view[pos:min(pos + UPLOAD_CHUNK, end)])
+                    if stream is not out:
+                        stream.close()
+                    self._count_bytes('split', instance, out.tell())
+            finally:
+                view.release()
+
+    def send_graph_slice(self, instance, store_path, rows, filename):
+        """
+        Stream rows (start, end) of a binary graph store to a worker as a store
+        of their own. Sent uncompressed since the mapper maps it into memory.
+        """
+        from graph_store import GraphStore
+        with GraphStore(store_path) as store, self.open_worker_file(instance, filename, 'wb') as out:
+            store.write_slice(out, *rows)
+            self._count_bytes('split', instance, out.tell())
+
+    @staticmethod
+    def line_cost(degree):
+        """Estimated mapper work for an adjacency line: d(d-1)/2 pairs plus d direct edges."""
+        return degree * (degree - 1) // 2 + degree if degree else 1
+
+    @staticmethod
+    def _scan_degrees(m):
+        """
+        Yield (start, end, degree) for every line of the mapped file, reading
+        it a chunk at a time. end includes the line's newline.
+        """
+        size = len(m)
+        pos = 0
+        while pos < size:
+            chunk_end = min(pos + SCAN_CHUNK, size)
+            if chunk_end < size:
+                # Stop the chunk after its last complete line
+                newline = m.rfind(b'\n', pos, chunk_end)
+                if newline == -1:
+                    newline = m.find(b'\n', chunk_end)
+                chunk_end = size if newline == -1 else newline + 1
+            for line in m[pos:chunk_end].split(b'\n'):
+                line_end = min(pos + len(line) + 1, chunk_end)
+                if line_end == pos:
+                    break
+                parts = line.strip().split(b'\t')
+                degree = parts[1].count(b',') + 1 if len(parts) > 1 and parts[1] else 0
+                yield pos, line_end, degree
+                pos = line_end
+
+    @staticmethod
+    def shard_bounds(degree, n_shards):
+        """
+        Cut a hub's pair space into at most n_shards (lo, hi) ranges of friend
+        indexes with roughly equal numbers of pairs.
+        """
+        total_pairs = degree * (degree - 1) // 2
+        bounds = []
+        lo = 0
+        done = 0
+        for k in range(1, n_shards + 1):
+            goal = total_pairs * k // n_shards
+            hi = lo
+            # Row i pairs friend i with the degree - 1 - i friends after it
+            while hi < degree and (done < goal or k == n_shards):
+                done += degree - 1 - hi
+                hi += 1
+            if hi > lo:
+                bounds.append((lo, hi))
+            lo = hi
+        return bounds
+
+    @staticmethod
+    def shard_line(line, lo, hi):
+        """
+        A hub's adjacency line with a third 'lo:hi' column: the mapper only
+        expands pairs whose first friend index is in [lo, hi), and only the
+        shard starting at 0 emits the direct edges.
+        """
+        user, friends = line.strip().split(b'\t')[:2]
+        return b'%s\t%s\t%d:%d\n' % (user, friends, lo, hi)
+
+    def split_by_cost(self, input_file, n_mappers):
+        """
+        Build n_mappers splits with balanced estimated cost (~d^2/2 per line).
+        Each split is a list of pieces in file order: (start, end) byte
+        ranges of whole lines, and (start, end, lo, hi) shards of a hub line
+        costing more than a split's fair share. Splits are cut where the
+        running cost crosses a multiple of the fair share, so each one gets a
+        few contiguous ranges. The file is streamed through mmap twice, once
+        for the total cost and once to place the cuts.
+        """
+        splits = [[] for _ in range(n_mappers)]
+        if os.path.getsize(input_file) == 0:
+            return splits
+        with open(input_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            total = sum(self.line_cost(degree) for _, _, degree in self._scan_degrees(m))
+            target = max(total / n_mappers, 1)
+
+            done = 0
+            for start, end, degree in self._scan_degrees(m):
+                cost = self.line_cost(degree)
+                if cost > target and n_mappers > 1:
+                    bounds = self.shard_bounds(degree, min(n_mappers, -(-cost // int(target))))
+                    pieces = [((start, end, lo, hi), cost / len(bounds)) for lo, hi in bounds]
+                else:
+                    pieces = [((start, end), cost)]
+                for piece, piece_cost in pieces:
+                    # A piece goes to the split its midpoint falls in
+                    split = splits[min(n_mappers - 1, int((done + piece_cost / 2) / target))]
+                    if len(piece) == 2 and split and len(split[-1]) == 2 and split[-1][1] == start:
+                        split[-1] = (split[-1][0], end)
+                    else:
+                        split.append(piece)
+                    done += piece_cost
         return splits
 
+    def build_query_file(self, input_file, target_users, query_file='targets.txt'):
+        """
+        Write the query file broadcast to mappers and reducers for a targeted run.
+        Its scope is the target users plus everyone adjacent to them, in either
+        direction, so mappers can skip every other adjacency line.
+        """
+        targets = set(target_users)
+        scope = set(targets)
+        with open(input_file, 'r') as f:
+            for line in f:
+                parts = line.strip().split('\t')
+                if len(parts) != 2:
+                    continue
+                user, friends = parts[0], [friend for friend in parts[1].split(',') if friend]
+                if user in targets:
+                    scope.update(friends)
+                elif not targets.isdisjoint(friends):
+                    scope.add(user)
+        write_query_file(query_file, targets, scope)
+        return query_file
+
     def collect_mapper_outputs(self, mapper_instances):
-        """Collect mapper outputs from mapper instances."""
-        all_mapper_outputs = []
+        """Stream mapper output records from the instance (or local copy) holding each map task's output."""
         for i, instance in enumerate(mapper_instances):
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            key = paramiko.RSAKey.from_private_key_file(f"{self.key_name}.pem")
-            ssh.connect(hostname=instance.public_ip_address, username='ubuntu', pkey=key)
-            
-            sftp = ssh.open_sftp()
-            with sftp.file(f'/home/ubuntu/mapper_output_{i}.txt', 'r') as f:
-                mapper_output = f.readlines()
-                all_mapper_outputs.extend(mapper_output)
-            
-            sftp.close()
-            ssh.close()
-        return all_mapper_outputs
-
-    def partition_mapper_outputs(self, all_mapper_outputs, n_reducers):
-        """Partition mapper outputs among reducers."""
-        partitions = [[] for _ in range(n_reducers)]
-        for line in all_mapper_outputs:
-            parts = line.strip().split('\t')
-            if len(parts) < 2:
-                continue
-            key = '\t'.join(parts[:2])
-            reducer_index = hash(key) % n_reducers
-            partitions[reducer_index].append(line)
-        
-        for i in range(len(partitions)):
-            partitions[i].sort()
-        return partitions
-
-    def distribute_to_reducers(self, partitions, reducer_instances):
-        """Distribute partitioned data to reducer instances."""
-        for i, instance in enumerate(reducer_instances):
-            partition_file = f'reducer_input_{i}.txt'
-            with open(partition_file, 'w') as f:
-                f.writelines(partitions[i])
-            
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            key = paramiko.RSAKey.from_private_key_file(f"{self.key_name}.pem")
-            ssh.connect(hostname=instance.public_ip_address, username='ubuntu', pkey=key)
-            
-            sftp = ssh.open_sftp()
-            sftp.put(partition_file, f'/home/ubuntu/reducer_input_{i}.txt')
-            ssh.exec_command(f'chmod +x /home/ubuntu/reducer_input_{i}.txt')
-            
-            sftp.close()
-            ssh.close()
+            with self.open_task_output(instance, f'mapper_output_{i}.txt') as f:
+                with wrap_stream(f, 'rb', self.codec) as stream:
+                    yield from read_records(stream, self.record_format)
+                    if not isinstance(instance, LocalCopy):
+                        self._count_bytes('collect', instance, f.tell())
+
+    def partition_mapper_outputs(self, all_mapper_outputs, n_reducers, mode='pair'):
+        """
+        Partition mapper output records among reducers with an external sort
+        (see shuffle.PartitionWriter). 'pair' routes each record by its pair.
+        'user' sends it to the reducer owning each of its two users, so every
+        reducer sees all the evidence for its own users and their top k is final.
+        Returns the local path of each reducer's sorted input file.
+        """
+        partition_files = [f'reducer_input_{i}.txt' for i in range(n_reducers)]
+        writer = PartitionWriter(partition_files, self.record_format, mode, self.memory_budget,
+                                 self.temp_dir, self.codec, self.compression_level)
+        writer.write_records(all_mapper_outputs)
+        self.shuffle_stats = {
+            'records_consumed': writer.records_written,
+            'spilled_runs': writer.spilled_runs,
+        }
+        writer.close()
+        return partition_files
 
-    def collect_and_process_results(self, reducer_instances):
-        """Collect and process final results from reducers."""
+    def collect_and_process_results(self, reducer_instances, target_users=None, partition_mode='pair'):
+        """
+        Collect and process final results from reducers.
+        With 'user' partitioning every user's list is already final on exactly
+        one reducer, so the lists are concatenated as they are.
+        """
         try:
             # Target users we want to process
-            target_users = ['924', '8941', '8942', '9019', '9020', '9021', '9022', '9990', '9992', '9993']
+            target_users = [str(user) for user in target_users or DEFAULT_TARGET_USERS]
             
             # Use defaultdict to combine recommendations from different reducers
             combined_recommendations = defaultdict(lambda: defaultdict(int))
+            final_recommendations = {}
             
             # Collect results from all reducers and combine them
             for i, instance in enumerate(reducer_instances):
-                ssh = paramiko.SSHClient()
-                ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                key = paramiko.RSAKey.from_private_key_file(f"{self.key_name}.pem")
-                ssh.connect(hostname=instance.public_ip_address, username='ubuntu', pkey=key)
-                
-                sftp = ssh.open_sftp()
-                with sftp.file(f'/home/ubuntu/reducer_output_{i}.txt', 'r') as f:
-                    for line in f:
-                        line = line.strip()
+                with self.open_task_output(instance, f'reducer_output_{i}.txt') as f:
+                    for line in wrap_stream(f, 'rb', self.codec):
+                        line = line.decode().strip()
                         if not line:
                             continue
                         
@@ -102,6 +350,10 @@ class DataProcessor:
                         # Only process target users
                         if user_id not in target_users:
                             continue
+
+                        if partition_mode == 'user':
+                            final_recommendations[user_id] = [rec.split(':')[0] for rec in recommendations.split(',') if rec]
+                            continue
                         
                         # Process each recommendation and its count
                         for rec in recommendations.split(','):
@@ -111,14 +363,16 @@ class DataProcessor:
                                 # Keep the highest count for each recommendation
                                 current_count = combined_recommendations[user_id][rec_id]
                                 combined_recommendations[user_id][rec_id] = max(current_count, count)
-                
-                sftp.close()
-                ssh.close()
+                    if not isinstance(instance, LocalCopy):
+                        self._count_bytes('merge', instance, f.tell())
             
             # Write final results
             with open('final_recommendations.txt', 'w') as f:
                 for user_id in target_users:
-                    if user_id in combined_recommendations:
+                    if user_id in final_recommendations:
+                        if final_recommendations[user_id]:
+                            f.write(f"{user_id} {','.join(final_recommendations[user_id])}\n")
+                    elif user_id in combined_recommendations:
                         # Sort recommendations:
                         # 1. Primary sort by count (descending)
                         # 2. Secondary sort by recommendation ID (ascending) when counts are equal
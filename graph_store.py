@@ -0,0 +1,276 @@
+# graph_store.py
+"""
+Binary CSR copy of an adjacency list file, loaded by mmap.
+
+Layout (little-endian):
+    header     HEADER (64 bytes): magic, version, flags, first_row, n_rows,
+               n_edges, source_size, source_mtime_ns, crc32 of the arrays
+    offsets    n_rows + 1 int32; row r's neighbors are
+               neighbors[offsets[r] - offsets[0]:offsets[r + 1] - offsets[0]]
+    neighbors  n_edges int32
+
+Row r holds the friend list of user first_row + r exactly as it appears in
+the text file. A store built from a file is cached next to it and reused for
+as long as the file's size and modification time are unchanged, so text
+parsing happens once instead of on every run. Opening a store checks its
+size against the header; a cached store is also checksummed once when it is
+reused, and rebuilt if it is damaged. A store can also be sliced to a range
+of rows, e.g. one mapper's share of the graph.
+"""
+import argparse
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import zlib
+from array import array
+
+MAGIC = b'FRCSR\x00\x00\x00'
+VERSION = 1
+HEADER = struct.Struct('<8sIIqqqqqII')
+
+# Set when every row is sorted and free of duplicates
+FLAG_SORTED_UNIQUE = 1
+
+COPY_CHUNK = 1024 * 1024
+
+def default_store_path(input_file):
+    return f'{input_file}.csr'
+
+def _to_bytes(values):
+    """Little-endian bytes of an int32 array."""
+    if sys.byteorder == 'big':
+        values = array('i', values)
+        values.byteswap()
+    return values.tobytes()
+
+def _source_identity(input_file):
+    stat = os.stat(input_file)
+    return stat.st_size, stat.st_mtime_ns
+
+def build_graph_store(input_file, output_path):
+    """
+    Convert an adjacency list file into a CSR store at output_path.
+    Friend lists are spooled to a temporary file in input order, then copied
+    into row order, so memory holds only per-user positions, not the graph.
+    """
+    source_size, source_mtime_ns = _source_identity(input_file)
+    starts = array('q')
+    lengths = array('i')
+    sorted_unique = True
+    n_edges = 0
+
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    with tempfile.TemporaryFile(dir=output_dir) as spool:
+        with open(input_file, 'r') as f:
+            for line in f:
+                parts = line.strip().split('\t')
+                if len(parts) != 2:
+                    continue
+                user = int(parts[0])
+                friends = array('i', (int(friend) for friend in parts[1].split(',') if friend))
+                if user >= len(starts):
+                    starts.extend([-1] * (user + 1 - len(starts)))
+                    lengths.extend([0] * (user + 1 - len(lengths)))
+                if starts[user] != -1:
+                    raise ValueError(f"User {user} has more than one line in {input_file}")
+                starts[user] = n_edges
+                lengths[user] = len(friends)
+                n_edges += len(friends)
+                if sorted_unique and any(a >= b for a, b in zip(friends, friends[1:])):
+                    sorted_unique = False
+                spool.write(_to_bytes(friends))
+        if n_edges >= 2 ** 31:
+            raise ValueError("Graph has too many edges for int32 offsets")
+
+        offsets = array('i', [0])
+        for length in lengths:
+            offsets.append(offsets[-1] + length)
+
+        fd, tmp_path = tempfile.mkstemp(suffix='.csr', dir=output_dir)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                out.write(b'\0' * HEADER.size)
+                offsets_bytes = _to_bytes(offsets)
+                out.write(offsets_bytes)
+                checksum = zlib.crc32(offsets_bytes)
+                spool.flush()
+                if n_edges:
+                    with mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ) as spooled:
+                        # Sorted input makes this one sequential copy
+                        for start, length in zip(starts, lengths):
+                            if length:
+                                chunk = spooled[start * 4:(start + length) * 4]
+                                out.write(chunk)
+                                checksum = zlib.crc32(chunk, checksum)
+                out.seek(0)
+                out.write(HEADER.pack(MAGIC, VERSION, FLAG_SORTED_UNIQUE if sorted_unique else 0, 0,
+                                      len(lengths), n_edges, source_size, source_mtime_ns, checksum, 0))
+            os.replace(tmp_path, output_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    return output_path
+
+def ensure_graph_store(input_file, store_path=None):
+    """Return the path of an up-to-date store for input_file, building it if needed."""
+    store_path = store_path or default_store_path(input_file)
+    if os.path.exists(store_path):
+        try:
+            with GraphStore(store_path, verify=True) as store:
+                if (store.source_size, store.source_mtime_ns) == _source_identity(input_file):
+                    return store_path
+        except ValueError as e:
+            print(f"Discarding damaged graph store: {e}")
+    print(f"Building graph store {store_path} from {input_file}")
+    return build_graph_store(input_file, store_path)
+
+class GraphStore:
+    """
+    Read-only, memory-mapped view of a store file. offsets and neighbors are
+    int32 memoryviews into the mapping, so neighbor lists are read in place.
+    """
+
+    def __init__(self, path, verify=False):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"{path} is empty")
+        if len(self._mmap) < HEADER.size:
+            self.close()
+            raise ValueError(f"{path} is too short for a graph store header")
+        (magic, version, self.flags, self.first_row, self.n_rows, self.n_edges,
+         self.source_size, self.source_mtime_ns, self.checksum, _) = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a version {VERSION} graph store")
+
+        offsets_end = HEADER.size + 4 * (self.n_rows + 1)
+        if len(self._mmap) != offsets_end + 4 * self.n_edges:
+            size = len(self._mmap)
+            self.close()
+            raise ValueError(f"{path} holds {size} bytes but its header describes "
+                             f"{offsets_end + 4 * self.n_edges}")
+        if verify:
+            with memoryview(self._mmap) as view, view[HEADER.size:] as data:
+                intact = zlib.crc32(data) == self.checksum
+            if not intact:
+                self.close()
+                raise ValueError(f"Checksum mismatch in {path}")
+
+        self._view = memoryview(self._mmap)
+        self._arrays = self._view[HEADER.size:offsets_end + 4 * self.n_edges]
+        if sys.byteorder == 'big':
+            # The file is little-endian; fall back to a swapped copy
+            swapped = array('i', self._arrays.tobytes())
+            swapped.byteswap()
+            self._arrays = memoryview(swapped)
+        ints = self._arrays.cast('B').cast('i')
+        self.offsets = ints[:self.n_rows + 1]
+        self.neighbors = ints[self.n_rows + 1:]
+        # Offset of this store's first neighbor; non-zero in slices
+        self.base = self.offsets[0]
+        if self.offsets[self.n_rows] - self.base != self.n_edges:
+            ints.release()
+            self.close()
+            raise ValueError(f"Offsets in {path} do not match its {self.n_edges} neighbors")
+
+    @property
+    def sorted_unique(self):
+        return bool(self.flags & FLAG_SORTED_UNIQUE)
+
+    def neighbors_of(self, user):
+        """Friend list of a user as an int32 memoryview, empty for unknown users."""
+        row = user - self.first_row
+        if row < 0 or row >= self.n_rows:
+            return self.neighbors[:0]
+        return self.neighbors[self.offsets[row] - self.base:self.offsets[row + 1] - self.base]
+
+    def rows(self, start=None, end=None):
+        """Yield (user, friends memoryview) for every user with friends in rows [start, end)."""
+        start = 0 if start is None else start
+        end = self.n_rows if end is None else min(end, self.n_rows)
+        for row in range(start, end):
+            lo, hi = self.offsets[row] - self.base, self.offsets[row + 1] - self.base
+            if hi > lo:
+                yield self.first_row + row, self.neighbors[lo:hi]
+
+    def row_ranges(self, n_parts, balance='edges', start=0, end=None):
+        """
+        Split rows [start, end) into n_parts (start, end) ranges holding about
+        the same number of rows ('rows') or of friend list entries ('edges').
+        """
+        end = self.n_rows if end is None else min(end, self.n_rows)
+        start = min(start, end)
+        if balance == 'rows':
+            cuts = [start + (end - start) * k // n_parts for k in range(1, n_parts)]
+        elif balance == 'edges':
+            cuts = []
+            row = start
+            first, last = self.offsets[start], self.offsets[end]
+            for k in range(1, n_parts):
+                target = first + (last - first) * k // n_parts
+                # Binary search for the first row starting at or after target
+                lo, hi = row, end
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    if self.offsets[mid] < target:
+                        lo = mid + 1
+                    else:
+                        hi = mid
+                row = lo
+                cuts.append(row)
+        else:
+            raise ValueError(f"Unknown balance: {balance}")
+        bounds = [start] + cuts + [end]
+        return list(zip(bounds, bounds[1:]))
+
+    def write_slice(self, stream, start, end):
+        """Write rows [start, end) to a binary stream as a store of their own."""
+        end = min(end, self.n_rows)
+        start = min(start, end)
+        offsets = self.offsets[start:end + 1]
+        lo, hi = offsets[0] - self.base, offsets[-1] - self.base
+        neighbors = self.neighbors[lo:hi]
+        if sys.byteorder == 'little':
+            offsets_bytes, neighbor_bytes = offsets.cast('B'), neighbors.cast('B')
+        else:
+            offsets_bytes, neighbor_bytes = _to_bytes(array('i', offsets)), _to_bytes(array('i', neighbors))
+        checksum = zlib.crc32(offsets_bytes)
+        checksum = zlib.crc32(neighbor_bytes, checksum)
+        stream.write(HEADER.pack(MAGIC, VERSION, self.flags, self.first_row + start, end - start, hi - lo,
+                                 self.source_size, self.source_mtime_ns, checksum, 0))
+        stream.write(offsets_bytes)
+        for pos in range(0, len(neighbor_bytes), COPY_CHUNK):
+            stream.write(neighbor_bytes[pos:pos + COPY_CHUNK])
+
+    def close(self):
+        for name in ('offsets', 'neighbors', '_arrays', '_view'):
+            view = getattr(self, name, None)
+            if isinstance(view, memoryview):
+                view.release()
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Convert an adjacency list into a binary CSR graph store')
+    parser.add_argument('--input', default='soc-LiveJournal1Adj.txt', help='Adjacency list input file')
+    parser.add_argument('--output', help='Store path (default: <input>.csr)')
+    parser.add_argument('--verify', action='store_true', help='Check the checksum of an existing store')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    path = ensure_graph_store(args.input, args.output)
+    with GraphStore(path, verify=args.verify) as store:
+        print(f"{path}: {store.n_rows} users, {store.n_edges} friend list entries")
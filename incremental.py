@@ -0,0 +1,288 @@
+# incremental.py
+"""
+Incremental recommendation updates for a changing friend graph.
+
+A full run computes, for every tracked user u, mutual[u][w] = |N(u) & N(w)|
+and u's top-k recommendations, and saves them as a state file. A delta of
+edge insertions and deletions is then applied without touching the rest of
+the graph: adding or removing (u, v) only changes the counts of pairs
+(u, w) for w in N(v) and (v, w) for w in N(u), plus the direct-friend
+exclusions of u and v. Top-k lists are recomputed only for users whose
+counts or friends changed, and only lists that actually changed are
+written out, so a delta costs time proportional to its size times the
+degrees involved rather than to the graph.
+
+The state is an SQLite database with a row per friendship, per counted pair
+and per top-k list, updated in place: applying a delta reads and writes only
+the rows of the users and pairs it touches, never the whole state. A delta
+is applied in one transaction, committed once its updates are written, so a
+failed apply leaves the previous state.
+
+Friendships are undirected here: the state is built from the union of both
+directions of every adjacency line. Counts are kept for all users, or only
+for --users, which keeps the state small on graphs like LiveJournal.
+
+    python incremental.py init --input soc-LiveJournal1Adj.txt --state state.db
+    python incremental.py apply --state state.db --delta delta.txt --output updates.txt
+    python incremental.py dump --state state.db --output all_recommendations.txt
+
+Delta lines are '+ u v' to add and '- u v' to remove a friendship.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+from collections import defaultdict
+
+from mapper import read_adjacency
+from reducer import format_recommendations, rank_recommendations
+
+STATE_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE tracked (user INTEGER PRIMARY KEY);
+CREATE TABLE friends (user INTEGER, friend INTEGER, PRIMARY KEY (user, friend)) WITHOUT ROWID;
+CREATE TABLE mutual (user INTEGER, other INTEGER, count INTEGER, PRIMARY KEY (user, other)) WITHOUT ROWID;
+CREATE TABLE recommendations (user INTEGER PRIMARY KEY, ranked TEXT);
+"""
+# Created after the initial rows are loaded; lets a user's best candidates be read in rank order
+RANK_INDEX = "CREATE INDEX mutual_rank ON mutual (user, count DESC, other)"
+
+class IncrementalRecommender:
+    """
+    A state database opened for reading and updating. Changes are only kept
+    once commit() is called; closing without it rolls them back.
+    """
+
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise ValueError(f"No state file at {path}; build one with 'init' first")
+        self.db = sqlite3.connect(path)
+        meta = dict(self.db.execute('SELECT key, value FROM meta'))
+        if meta.get('version') != str(STATE_VERSION):
+            self.db.close()
+            raise ValueError(f"Unsupported state version in {path}")
+        self.top_k = int(meta['top_k'])
+        self.track_all = meta['track_all'] == '1'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.rollback()
+        self.db.close()
+
+    def commit(self):
+        self.db.commit()
+
+    @staticmethod
+    def build(input_file, path, top_k=10, tracked=None):
+        """
+        Build the state file from an adjacency list file with a full pass in
+        memory. The file is written beside path and moved into place once
+        complete.
+        """
+        tracked = set(tracked) if tracked is not None else None
+        is_tracked = lambda user: tracked is None or user in tracked
+        adjacency = defaultdict(set)
+        with open(input_file, 'r') as f:
+            for user, friends, _ in read_adjacency(f, 'binary'):
+                for friend in friends:
+                    if friend != user:
+                        adjacency[user].add(friend)
+                        adjacency[friend].add(user)
+
+        # mutual[u][w]: number of mutual friends of u and w, for tracked u
+        mutual = defaultdict(lambda: defaultdict(int))
+        for user, friends in adjacency.items():
+            # user is a mutual friend of every pair in its list
+            for friend in friends:
+                if is_tracked(friend):
+                    counts = mutual[friend]
+                    for other in friends:
+                        if other != friend:
+                            counts[other] += 1
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+        os.close(fd)
+        try:
+            db = sqlite3.connect(tmp_path)
+            try:
+                db.execute('PRAGMA journal_mode = OFF')
+                db.execute('PRAGMA synchronous = OFF')
+                db.executescript(SCHEMA)
+                db.executemany('INSERT INTO meta VALUES (?, ?)', [
+                    ('version', str(STATE_VERSION)), ('top_k', str(top_k)), ('track_all', '1' if tracked is None else '0')
+                ])
+                db.executemany('INSERT INTO tracked VALUES (?)', ((user,) for user in sorted(tracked or ())))
+                db.executemany('INSERT INTO friends VALUES (?, ?)',
+                               ((user, friend) for user in sorted(adjacency) for friend in sorted(adjacency[user])))
+                db.executemany('INSERT INTO mutual VALUES (?, ?, ?)',
+                               ((user, other, count) for user in sorted(mutual)
+                                for other, count in sorted(mutual[user].items())))
+                db.execute(RANK_INDEX)
+                rows = []
+                for user, counts in mutual.items():
+                    friends = adjacency[user]
+                    ranked = rank_recommendations([(candidate, count) for candidate, count in counts.items()
+                                                   if candidate not in friends], top_k)
+                    if ranked:
+                        rows.append((user, json.dumps(ranked)))
+                db.executemany('INSERT INTO recommendations VALUES (?, ?)', rows)
+                db.commit()
+            finally:
+                db.close()
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return len(rows)
+
+    def is_tracked(self, user):
+        return self.track_all or self.db.execute('SELECT 1 FROM tracked WHERE user = ?', (user,)).fetchone() is not None
+
+    def friends(self, user):
+        return {friend for friend, in self.db.execute('SELECT friend FROM friends WHERE user = ?', (user,))}
+
+    def recommendations(self, user):
+        """Current top-k (candidate, count) list of a user."""
+        row = self.db.execute('SELECT ranked FROM recommendations WHERE user = ?', (user,)).fetchone()
+        return [tuple(rec) for rec in json.loads(row[0])] if row else []
+
+    def users_with_recommendations(self):
+        return [user for user, in self.db.execute('SELECT user FROM recommendations ORDER BY user')]
+
+    def _rank(self, user):
+        # Candidates come in rank order, so this stops after top_k that are not friends
+        friends = self.friends(user)
+        ranked = []
+        cursor = self.db.execute('SELECT other, count FROM mutual WHERE user = ? ORDER BY count DESC, other', (user,))
+        for candidate, count in cursor:
+            if candidate not in friends:
+                ranked.append((candidate, count))
+                if len(ranked) == self.top_k:
+                    break
+        cursor.close()
+        return ranked
+
+    def refresh(self, users):
+        """Recompute top-k for the given users; return those whose list changed."""
+        changed = []
+        for user in users:
+            if not self.is_tracked(user):
+                continue
+            ranked = self._rank(user)
+            if ranked != self.recommendations(user):
+                changed.append(user)
+                if ranked:
+                    self.db.execute('INSERT OR REPLACE INTO recommendations VALUES (?, ?)', (user, json.dumps(ranked)))
+                else:
+                    self.db.execute('DELETE FROM recommendations WHERE user = ?', (user,))
+        return changed
+
+    def _shift(self, user, others, delta, affected):
+        """Add delta to the count of user with each of others, in both directions."""
+        rows = []
+        for other in others:
+            if other == user:
+                continue
+            for a, b in ((user, other), (other, user)):
+                if self.is_tracked(a):
+                    rows.append((a, b, delta))
+                    affected.add(a)
+        self.db.executemany('INSERT INTO mutual VALUES (?, ?, ?) '
+                            'ON CONFLICT (user, other) DO UPDATE SET count = count + excluded.count', rows)
+        if delta < 0:
+            self.db.executemany('DELETE FROM mutual WHERE user = ? AND other = ? AND count <= 0',
+                                [(a, b) for a, b, _ in rows])
+
+    def add_edge(self, u, v, affected):
+        if u == v or v in self.friends(u):
+            return
+        # v becomes a mutual friend of u and each of v's friends, and vice versa
+        self._shift(u, self.friends(v), 1, affected)
+        self._shift(v, self.friends(u), 1, affected)
+        self.db.executemany('INSERT INTO friends VALUES (?, ?)', [(u, v), (v, u)])
+        affected.update((u, v))
+
+    def remove_edge(self, u, v, affected):
+        if v not in self.friends(u):
+            return
+        self.db.executemany('DELETE FROM friends WHERE user = ? AND friend = ?', [(u, v), (v, u)])
+        self._shift(u, self.friends(v), -1, affected)
+        self._shift(v, self.friends(u), -1, affected)
+        affected.update((u, v))
+
+    def apply_delta(self, changes):
+        """
+        Apply ('+' or '-', u, v) changes in order.
+        Returns the users whose top-k list changed.
+        """
+        affected = set()
+        for op, u, v in changes:
+            if op == '+':
+                self.add_edge(u, v, affected)
+            elif op == '-':
+                self.remove_edge(u, v, affected)
+            else:
+                raise ValueError(f"Unknown delta operation: {op}")
+        return self.refresh(affected)
+
+def read_delta(path):
+    """Read '+ u v' / '- u v' lines into (op, u, v) tuples."""
+    changes = []
+    with open(path, 'r') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) != 3:
+                continue
+            changes.append((parts[0], int(parts[1]), int(parts[2])))
+    return changes
+
+def write_updates(recommender, users, output_file):
+    """Write the new top-k of each user in reducer output format; empty lists mean none are left."""
+    with open(output_file, 'w') as f:
+        for user in sorted(users):
+            f.write(format_recommendations(user, recommender.recommendations(user)) + '\n')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Incremental friend recommendation updates')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    init = subparsers.add_parser('init', help='Build the state from an adjacency list')
+    init.add_argument('--input', default='soc-LiveJournal1Adj.txt', help='Adjacency list input file')
+    init.add_argument('--users', help='Comma-separated users to track (default: all)')
+    init.add_argument('--top-k', type=int, default=10, help='Recommendations kept per user')
+
+    apply = subparsers.add_parser('apply', help='Apply a delta of edge changes')
+    apply.add_argument('--delta', required=True, help="File of '+ u v' and '- u v' lines")
+    apply.add_argument('--output', default='updated_recommendations.txt',
+                       help='Where to write the users whose recommendations changed')
+
+    dump = subparsers.add_parser('dump', help='Write every tracked user\'s current recommendations')
+    dump.add_argument('--output', default='all_recommendations.txt', help='Output file')
+
+    for subparser in (init, apply, dump):
+        subparser.add_argument('--state', default='recommendations_state.db', help='State file')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == 'init':
+        tracked = [int(user) for user in args.users.split(',')] if args.users else None
+        n_users = IncrementalRecommender.build(args.input, args.state, args.top_k, tracked)
+        print(f"State for {n_users} users written to {args.state}")
+    elif args.command == 'apply':
+        with IncrementalRecommender(args.state) as recommender:
+            changed = recommender.apply_delta(read_delta(args.delta))
+            write_updates(recommender, changed, args.output)
+            recommender.commit()
+        print(f"{len(changed)} users' recommendations changed, written to {args.output}")
+    else:
+        with IncrementalRecommender(args.state) as recommender:
+            write_updates(recommender, recommender.users_with_recommendations(), args.output)
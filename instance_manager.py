@@ -1,21 +1,29 @@
 import boto3
-import paramiko
 import time
 
+from connection_pool import SSHConnectionPool
+
 class InstanceManager:
-    def __init__(self, aws_config):
+    python = 'python3'
+
+    def __init__(self, aws_config, connection_pool=None):
         self.ec2_client = boto3.client('ec2', region_name='us-east-1')
         self.aws_config = aws_config
+        self.connection_pool = connection_pool or SSHConnectionPool(aws_config['key_name'])
         
     def launch_instance(self, instance_type='t2.micro', name='Instance'):
         """Launch an EC2 instance and tag it with a name."""
+        params = {}
+        if self.aws_config.get('instance_profile'):
+            params['IamInstanceProfile'] = {'Name': self.aws_config['instance_profile']}
         response = self.ec2_client.run_instances(
             ImageId=self.aws_config['image_id'],
             InstanceType=instance_type,
             KeyName=self.aws_config['key_name'],
             SecurityGroupIds=[self.aws_config['security_group_id']],
             MinCount=1,
-            MaxCount=1
+            MaxCount=1,
+            **params
         )
         instance_id = response['Instances'][0]['InstanceId']
         
@@ -27,7 +35,8 @@ class InstanceManager:
             Tags=[{'Key': 'Name', 'Value': name}]
         )
         
-        ec2_resource = boto3.resource('ec2', region_name='us-east-1')
+        # Resources are not thread-safe, so each launch gets its own session
+        ec2_resource = boto3.session.Session().resource('ec2', region_name='us-east-1')
         instance = ec2_resource.Instance(instance_id)
         
         while instance.public_ip_address is None:
@@ -66,20 +75,8 @@ class InstanceManager:
             # Initial wait for instance to be ready
             time.sleep(90)
             
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            key = paramiko.RSAKey.from_private_key_file(f"{self.aws_config['key_name']}.pem")
-            
-            # Try to connect with retries
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    ssh.connect(hostname=instance.public_ip_address, username='ubuntu', pkey=key)
-                    break
-                except Exception as e:
-                    if attempt == max_retries - 1:
-                        raise
-                    time.sleep(30)
+            # The pool retries the connection while sshd comes up
+            ssh = self.connection_pool.get_client(instance)
             
             # Wait for system to be ready
             if not self.wait_for_system_ready(ssh):
@@ -88,7 +85,7 @@ class InstanceManager:
             commands = [
                 "sudo apt-get update -y",
                 "sudo apt-get install -y python3-pip",
-                "pip3 install boto3"
+                "pip3 install boto3 numpy"
             ]
             
             for cmd in commands:
@@ -98,7 +95,6 @@ class InstanceManager:
                     error_output = stderr.read().decode()
                     raise Exception(f"Command '{cmd}' failed with status {exit_status}, error: {error_output}")
             
-            ssh.close()
             print(f"Setup completed for instance: {instance.id}")
         except Exception as e:
             print(f"Error setting up instance {instance.id}: {e}")
@@ -107,17 +103,10 @@ class InstanceManager:
     def deploy_code(self, instance, script_name):
         """Deploy code to instance"""
         try:
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            key = paramiko.RSAKey.from_private_key_file(f"{self.aws_config['key_name']}.pem")
-            ssh.connect(hostname=instance.public_ip_address, username='ubuntu', pkey=key)
-            
-            sftp = ssh.open_sftp()
-            sftp.put(script_name, f'/home/ubuntu/{script_name}')
-            ssh.exec_command(f'chmod +x /home/ubuntu/{script_name}')
+            with self.connection_pool.sftp_session(instance) as sftp:
+                sftp.put(script_name, f'/home/ubuntu/{script_name}')
+                sftp.chmod(f'/home/ubuntu/{script_name}', 0o755)
             
-            sftp.close()
-            ssh.close()
             print(f"Deployed {script_name} to instance: {instance.id}")
         except Exception as e:
             print(f"Error deploying code to instance {instance.id}: {e}")
@@ -126,10 +115,7 @@ class InstanceManager:
     def run_ssh_command(self, instance, command):
         """Run command on remote instance"""
         try:
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            key = paramiko.RSAKey.from_private_key_file(f"{self.aws_config['key_name']}.pem")
-            ssh.connect(hostname=instance.public_ip_address, username='ubuntu', pkey=key)
+            ssh = self.connection_pool.get_client(instance)
             
             stdin, stdout, stderr = ssh.exec_command(command)
             exit_status = stdout.channel.recv_exit_status()
@@ -137,8 +123,10 @@ class InstanceManager:
             if exit_status != 0:
                 error_output = stderr.read().decode()
                 raise Exception(f"Command failed with status {exit_status}, error: {error_output}")
-            
-            ssh.close()
         except Exception as e:
             print(f"Error running command on instance {instance.id}: {e}")
-            raise
\ No newline at end of file
+            raise
+
+    def worker_path(self, instance, filename):
+        """Absolute path of a file in the instance's home directory"""
+        return f'/home/ubuntu/{filename}'
\ No newline at end of file
@@ -0,0 +1,125 @@
+# intra_node.py
+"""
+Helpers for running a mapper or reducer as several processes on one node.
+
+The input is first made into a plain local file (spooled from stdin when it
+arrives through a pipe or compressed), then cut into byte ranges that each
+worker process reads on its own: mapper ranges start on line boundaries,
+reducer ranges on pair boundaries of the sorted records, so no pair is split
+between two workers. Workers write part files that the parent combines into
+the node's single output.
+"""
+import io
+import multiprocessing
+import os
+import shutil
+
+from records import RECORD_SIZE, parse_text_record
+
+COPY_CHUNK = 1024 * 1024
+
+def default_workers():
+    """One worker process per core."""
+    return os.cpu_count() or 1
+
+def spool(stream, path):
+    """Copy a binary stream into a file and return its size."""
+    with open(path, 'wb') as f:
+        shutil.copyfileobj(stream, f, COPY_CHUNK)
+        return f.tell()
+
+class _RangeIO(io.RawIOBase):
+    """Raw reader over bytes [start, end) of a file."""
+
+    def __init__(self, path, start, end):
+        self._file = open(path, 'rb', buffering=0)
+        self._file.seek(start)
+        self._remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = min(len(buffer), self._remaining)
+        if n <= 0:
+            return 0
+        n = self._file.readinto(memoryview(buffer)[:n])
+        self._remaining -= n
+        return n
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+def open_range(path, start, end):
+    """Buffered binary stream over bytes [start, end) of a file."""
+    return io.BufferedReader(_RangeIO(path, start, end), COPY_CHUNK)
+
+def line_ranges(path, n_parts, start=0, end=None):
+    """Cut bytes [start, end) of a text file into n_parts ranges starting on line boundaries."""
+    end = os.path.getsize(path) if end is None else end
+    cuts = [start]
+    with open(path, 'rb') as f:
+        for k in range(1, n_parts):
+            pos = start + (end - start) * k // n_parts
+            if pos > cuts[-1]:
+                # Move to the start of the next line
+                f.seek(pos - 1)
+                f.readline()
+                pos = min(f.tell(), end)
+            cuts.append(max(pos, cuts[-1]))
+    cuts.append(end)
+    return [(lo, hi) for lo, hi in zip(cuts, cuts[1:]) if hi > lo]
+
+def _pair_at(f, fmt):
+    """Pair of the record at the file position, or None at the end of the file."""
+    if fmt == 'binary':
+        data = f.read(RECORD_SIZE)
+        return data[:8] if len(data) == RECORD_SIZE else None
+    record = parse_text_record(f.readline())
+    return record[:2] if record is not None else None
+
+def group_ranges(path, fmt, n_parts):
+    """
+    Cut a file of sorted records into n_parts ranges that start where a new
+    pair starts, so every pair's records fall in exactly one range.
+    """
+    size = os.path.getsize(path)
+    cuts = [0]
+    with open(path, 'rb') as f:
+        for k in range(1, n_parts):
+            pos = size * k // n_parts
+            if fmt == 'binary':
+                pos -= pos % RECORD_SIZE
+            elif pos > 0:
+                f.seek(pos - 1)
+                f.readline()
+                pos = f.tell()
+            if pos <= cuts[-1] or pos >= size:
+                continue
+            # Skip the rest of the pair found at the cut; it belongs to the previous range
+            f.seek(pos)
+            pair = _pair_at(f, fmt)
+            while True:
+                pos = f.tell()
+                next_pair = _pair_at(f, fmt)
+                if next_pair != pair:
+                    break
+            if pos < size:
+                cuts.append(pos)
+    cuts.append(size)
+    return [(lo, hi) for lo, hi in zip(cuts, cuts[1:]) if hi > lo]
+
+def run_parts(function, jobs, workers):
+    """Run function on every job in a pool of worker processes; results keep the order of jobs."""
+    if workers <= 1 or len(jobs) <= 1:
+        return [function(job) for job in jobs]
+    with multiprocessing.Pool(min(workers, len(jobs))) as pool:
+        return pool.map(function, jobs, chunksize=1)
+
+def add_stats(total, stats):
+    """Sum numeric worker stats into total."""
+    for key, value in stats.items():
+        if isinstance(value, (int, float)):
+            total[key] = total.get(key, 0) + value
+    return total
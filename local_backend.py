@@ -0,0 +1,83 @@
+import os
+import shutil
+import subprocess
+import sys
+from contextlib import contextmanager
+
+from data_processor import DataProcessor
+
+
+class LocalInstance:
+    """A worker slot backed by a scratch directory on the local machine."""
+
+    def __init__(self, instance_id, name, workdir):
+        self.id = instance_id
+        self.name = name
+        self.workdir = workdir
+
+    def __repr__(self):
+        return f"LocalInstance({self.id!r})"
+
+
+class LocalInstanceManager:
+    """Drop-in replacement for InstanceManager that runs workers as local processes."""
+
+    python = sys.executable
+
+    def __init__(self, work_dir='local_workers'):
+        self.work_dir = os.path.abspath(work_dir)
+
+    def launch_instance(self, instance_type=None, name='Instance'):
+        """Create a scratch directory that plays the role of an instance."""
+        instance_id = name.lower().replace(' ', '-')
+        workdir = os.path.join(self.work_dir, instance_id)
+        os.makedirs(workdir, exist_ok=True)
+        print(f"Launched local worker: {instance_id}")
+        return LocalInstance(instance_id, name, workdir)
+
+    def setup_instance(self, instance):
+        """Nothing to install locally; the orchestrator's interpreter is reused."""
+        print(f"Setup completed for local worker: {instance.id}")
+
+    def deploy_code(self, instance, script_name):
+        """Copy a file into the worker's directory"""
+        shutil.copy(script_name, os.path.join(instance.workdir, os.path.basename(script_name)))
+        print(f"Deployed {script_name} to local worker: {instance.id}")
+
+    def run_ssh_command(self, instance, command):
+        """Run a shell command inside the worker's directory"""
+        result = subprocess.run(command, shell=True, cwd=instance.workdir, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            error_output = result.stderr.decode()
+            print(f"Error running command on local worker {instance.id}: {error_output}")
+            raise Exception(f"Command failed with status {result.returncode}, error: {error_output}")
+
+    def worker_path(self, instance, filename):
+        """Absolute path of a file in the worker's directory"""
+        return os.path.join(instance.workdir, filename)
+
+    def terminate_instances(self, instances):
+        """Remove the scratch directories of the given workers"""
+        for instance in instances:
+            shutil.rmtree(instance.workdir, ignore_errors=True)
+        print(f"Removed local workers: {[i.id for i in instances]}")
+
+
+class LocalDataProcessor(DataProcessor):
+    """DataProcessor that reads and writes worker files on the local filesystem."""
+
+    # Local mappers read their byte range of the input file in place
+    reads_input_directly = True
+
+    def __init__(self, record_format='text', memory_budget=500000, temp_dir=None, codec='none',
+                 compression_level=None):
+        super().__init__(None, record_format, memory_budget, temp_dir, codec=codec,
+                         compression_level=compression_level)
+
+    @contextmanager
+    def open_worker_file(self, instance, filename, mode='r'):
+        with open(os.path.join(instance.workdir, filename), mode) as f:
+            yield f
+
+    def put_worker_file(self, instance, local_path, filename):
+        shutil.copy(local_path, os.path.join(instance.workdir, filename))
@@ -1,108 +1,764 @@
-from aws_setup import AWSResourceManager
-from instance_manager import InstanceManager
+import argparse
+import json
+import os
+import shlex
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from checkpoint import (CheckpointStore, LocalCopy, code_version, digest, graph_rows_digest, pieces_digest,
+                        range_digest)
 from data_processor import DataProcessor
+from records import MIN_SAMPLE_DEGREE
+from run_report import RunReport
+from scheduler import TaskScheduler
+from shuffle import open_store, partition_key
+
+# Files every mapper and reducer needs on its instance
+MAPPER_FILES = ['mapper.py', 'records.py', 'run_report.py', 'shuffle.py', 'graph_store.py', 'intra_node.py']
+REDUCER_FILES = ['reducer.py', 'records.py', 'run_report.py', 'shuffle.py', 'intra_node.py']
+
+class PhaseError(Exception):
+    """Raised when a phase fails on one or more instances; errors maps instance name to exception."""
+
+    def __init__(self, phase, errors):
+        self.phase = phase
+        self.errors = errors
+        details = '; '.join(f"{name}: {error}" for name, error in errors.items())
+        super().__init__(f"{phase} failed on {len(errors)} instance(s): {details}")
 
 class MapReduceOrchestrator:
-    def __init__(self, input_file, n_mappers=3, n_reducers=2):
+    def __init__(self, input_file, n_mappers=3, n_reducers=2, backend='ec2', work_dir='local_workers',
+                 combine=False, record_format='text', shuffle_memory_budget=500000, max_concurrency=16,
+                 target_users=None, top_k=10, streaming_reducer=False, report_file='run_report.json',
+                 split_strategy='lines', partition_mode='pair', codec='none', compression_level=None,
+                 shuffle_store=None, instance_profile=None, graph_store=False, map_tasks=None, reduce_tasks=None,
+                 max_attempts=3, speculative=False, vectorized=False, workers_per_node=None,
+                 checkpoint_store=None, sample_degree=None):
         self.input_file = input_file
         self.n_mappers = n_mappers
         self.n_reducers = n_reducers
+        # Splits and partitions are tasks handed out to the instances as they become free
+        self.map_tasks = map_tasks or n_mappers
+        self.reduce_tasks = reduce_tasks or n_reducers
+        self.max_attempts = max_attempts
+        self.speculative = speculative
+        # Instance whose files hold each task's output, once the task has succeeded
+        self.map_placement = []
+        self.reduce_placement = []
+        # Uploads a map task's split to an instance; set by the split phase
+        self._send_split = None
+        self.partition_files = None
+        self._staged = set()
+        self.backend = backend
+        self.combine = combine
+        self.record_format = record_format
+        if vectorized and record_format != 'binary':
+            raise ValueError("The vectorized mapper writes binary records only")
+        self.vectorized = vectorized
+        # Approximate mode: mappers sample the friends of users with more than sample_degree
+        if sample_degree is not None:
+            if combine:
+                raise ValueError("Approximate mode needs one record per mutual friend; it cannot combine")
+            if sample_degree < MIN_SAMPLE_DEGREE:
+                raise ValueError(f"sample_degree must be at least {MIN_SAMPLE_DEGREE}")
+        self.sample_degree = sample_degree
+        # Processes per mapper or reducer; None lets each node use all of its cores. Local
+        # workers already share this machine's cores, so they run one process each by default.
+        if workers_per_node is None and backend == 'local':
+            workers_per_node = 1
+        self.workers_per_node = workers_per_node
+        self.max_concurrency = max_concurrency
+        # Only compute recommendations for these users when set
+        self.target_users = [str(user) for user in target_users] if target_users else None
+        self.query_file = None
+        # Byte range of the input (row range of the graph store) each mapper reads
+        # in place, when workers can see this host's files
+        self.input_ranges = None
+        self.top_k = top_k
+        self.streaming_reducer = streaming_reducer
+        self.split_strategy = split_strategy
+        if graph_store and split_strategy == 'cost':
+            raise ValueError("Cost-based splits shard text lines and cannot use the graph store")
+        # Mappers read a binary CSR copy of the input instead of parsing text
+        self.graph_store = graph_store
+        self.graph_store_path = None
+        self.partition_mode = partition_mode
+        self.codec = codec
+        self.compression_level = compression_level
+        self.shuffle_memory_budget = shuffle_memory_budget
+        # Workers exchange partitions through this store instead of through this host when set
+        if shuffle_store and not shuffle_store.startswith('s3://'):
+            shuffle_store = os.path.abspath(shuffle_store)
+        self.shuffle_store = shuffle_store
+        self.shuffle = open_store(shuffle_store) if shuffle_store else None
+        # Phase outputs are saved to and reused from this store when set
+        if checkpoint_store and not checkpoint_store.startswith('s3://'):
+            checkpoint_store = os.path.abspath(checkpoint_store)
+        self.checkpoints = CheckpointStore(checkpoint_store) if checkpoint_store else None
+        self.map_keys = self.partition_keys = self.reduce_keys = None
         self.mapper_instances = []
         self.reducer_instances = []
-        
-        # Initialize AWS resources
-        self.aws_manager = AWSResourceManager()
-        self.aws_config = self.aws_manager.setup_aws_resources()
-        self.instance_manager = InstanceManager(self.aws_config)
-        self.data_processor = DataProcessor(self.aws_config['key_name'])
+        self.aws_manager = None
+        self.connection_pool = None
+        self.report_file = report_file
+        self.report = RunReport({
+            'input_file': input_file, 'n_mappers': n_mappers, 'n_reducers': n_reducers,
+            'backend': backend, 'combine': combine, 'record_format': record_format,
+            'target_users': self.target_users, 'top_k': top_k, 'streaming_reducer': streaming_reducer,
+            'split_strategy': split_strategy, 'partition_mode': partition_mode,
+            'codec': codec, 'compression_level': compression_level, 'shuffle_store': self.shuffle_store,
+            'graph_store': graph_store, 'map_tasks': self.map_tasks, 'reduce_tasks': self.reduce_tasks,
+            'max_attempts': max_attempts, 'speculative': speculative, 'vectorized': vectorized,
+            'workers_per_node': self.workers_per_node, 'checkpoint_store': checkpoint_store,
+            'sample_degree': sample_degree,
+        })
+
+        if backend == 'local':
+            # Workers are processes on this machine, no AWS modules needed
+            from local_backend import LocalInstanceManager, LocalDataProcessor
+            self.instance_manager = LocalInstanceManager(work_dir)
+            self.data_processor = LocalDataProcessor(record_format, shuffle_memory_budget, codec=codec,
+                                                     compression_level=compression_level)
+        elif backend == 'ec2':
+            from aws_setup import AWSResourceManager
+            from connection_pool import SSHConnectionPool
+            from instance_manager import InstanceManager
+
+            # Initialize AWS resources
+            self.aws_manager = AWSResourceManager(instance_profile=instance_profile)
+            self.aws_config = self.aws_manager.setup_aws_resources()
+            # One SSH connection per instance, shared by every phase
+            self.connection_pool = SSHConnectionPool(self.aws_config['key_name'])
+            self.instance_manager = InstanceManager(self.aws_config, self.connection_pool)
+            self.data_processor = DataProcessor(self.aws_config['key_name'], record_format,
+                                                shuffle_memory_budget, connection_pool=self.connection_pool,
+                                                codec=codec, compression_level=compression_level)
+        else:
+            raise ValueError(f"Unknown backend: {backend}")
+
+    def _worker_command(self, instance, script, input_name, output_name, args=''):
+        """Build the shell command that runs a script on a worker"""
+        path = lambda name: shlex.quote(self.instance_manager.worker_path(instance, name))
+        script_args = f' {args}' if args else ''
+        stdin = f' < {path(input_name)}' if input_name else ''
+        return f'{shlex.quote(self.instance_manager.python)} {path(script)}{script_args}{stdin} > {path(output_name)}'
+
+    def _worker_arg(self, instance, flag, filename):
+        return f'{flag} {shlex.quote(self.instance_manager.worker_path(instance, filename))}'
+
+    def _shared_worker_args(self):
+        """Compression and worker process flags shared by mappers and reducers"""
+        args = [f'--workers {self.workers_per_node}'] if self.workers_per_node else []
+        if self.codec == 'none':
+            return args
+        args.append(f'--codec {self.codec}')
+        if self.compression_level is not None:
+            args.append(f'--compression-level {self.compression_level}')
+        return args
+
+    def _mapper_input(self, i):
+        """File piped into a mapper; mappers given a range or a graph store read their input themselves"""
+        return None if self.input_ranges or self.graph_store else f'split_{i}.txt'
+
+    def _mapper_args(self, i, instance):
+        """Command line flags passed to every mapper"""
+        args = [f'--format {self.record_format}', self._worker_arg(instance, '--stats', f'mapper_stats_{i}.json')]
+        args.extend(self._shared_worker_args())
+        if self.graph_store and self.input_ranges:
+            start, end = self.input_ranges[i]
+            args.append(f'--graph {shlex.quote(os.path.abspath(self.graph_store_path))} --rows {start}:{end}')
+        elif self.graph_store:
+            args.append(self._worker_arg(instance, '--graph', f'split_{i}.csr'))
+        elif self.input_ranges:
+            start, end = self.input_ranges[i]
+            args.append(f'--input {shlex.quote(os.path.abspath(self.input_file))} --byte-range {start}:{end}')
+        if self.combine:
+            args.append('--combine')
+        if self.vectorized:
+            args.append('--vectorized')
+        if self.sample_degree:
+            args.append(f'--sample-degree {self.sample_degree}')
+        if self.query_file:
+            args.append(self._worker_arg(instance, '--targets', self.query_file))
+        if self.shuffle_store:
+            args.append(f'--shuffle-store {shlex.quote(self.shuffle_store)} --map-index {i} '
+                        f'--partitions {self.reduce_tasks} --partition-mode {self.partition_mode} '
+                        f'--memory-budget {self.shuffle_memory_budget}')
+        return ' '.join(args)
+
+    def _reducer_input(self, i):
+        """File piped into a reducer; with a shuffle store the reducer fetches its own input"""
+        return None if self.shuffle_store else f'reducer_input_{i}.txt'
+
+    def _reducer_args(self, i, instance):
+        """Command line flags passed to every reducer"""
+        args = [f'--format {self.record_format}', f'--top-k {self.top_k}',
+                self._worker_arg(instance, '--stats', f'reducer_stats_{i}.json')]
+        args.extend(self._shared_worker_args())
+        if self.streaming_reducer:
+            args.append('--streaming')
+        if self.sample_degree:
+            args.append('--approximate')
+        if self.partition_mode == 'user':
+            args.append(f'--partition {i} --n-partitions {self.reduce_tasks}')
+        if self.query_file:
+            args.append(self._worker_arg(instance, '--targets', self.query_file))
+        if self.shuffle_store:
+            args.append(f'--shuffle-store {shlex.quote(self.shuffle_store)} --reducer-index {i} '
+                        f'--n-mappers {self.map_tasks}')
+        return ' '.join(args)
+
+    def _run_concurrently(self, phase, items, fn, label=str):
+        """
+        Run fn on every item using at most max_concurrency threads.
+        Every item is attempted; failures are collected per item and raised
+        together as a PhaseError once the phase has finished.
+        """
+        results = [None] * len(items)
+        errors = {}
+        max_workers = max(1, min(self.max_concurrency, len(items)))
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {pool.submit(fn, item): index for index, item in enumerate(items)}
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    errors[label(items[index])] = e
+        if errors:
+            raise PhaseError(phase, errors)
+        return results
+
+    def _preferred_instance(self, instances):
+        """Tasks are staged round-robin, so task t's input starts out on instance t mod n"""
+        return lambda task: instances[task % len(instances)]
+
+    def _schedule(self, phase, instances, tasks, command_for, stage=None):
+        """
+        Run tasks on the instances through a TaskScheduler, staging each
+        task's input on the instance that runs it first. Returns the instance
+        that ran each task by task; failed tasks are raised as a PhaseError.
+        """
+        report_phase = phase.lower()
+
+        def run(task, instance):
+            start = time.perf_counter()
+            try:
+                if stage is not None:
+                    stage(task, instance)
+                self.instance_manager.run_ssh_command(instance, command_for(task, instance))
+            finally:
+                self.report.add_instance_seconds(report_phase, instance.id, time.perf_counter() - start)
+
+        scheduler = TaskScheduler(instances, self.max_attempts, self.speculative,
+                                  preferred=self._preferred_instance(instances))
+        placement, errors = scheduler.run(tasks, run)
+        self.report.set_counts(report_phase, scheduling=scheduler.stats)
+        if errors:
+            raise PhaseError(phase, {f"task {task}": error for task, error in errors.items()})
+        return {task: instance for task, (instance, _) in placement.items()}
+
+    def _stage_split(self, task, instance):
+        """Upload a map task's split to an instance that does not have it yet"""
+        if self._send_split is not None and ('map', task, instance.id) not in self._staged:
+            self._send_split(task, instance)
+            self._staged.add(('map', task, instance.id))
+
+    def _stage_partition(self, task, instance, phase='reduce'):
+        """Upload a reduce task's partition to an instance that does not have it yet"""
+        if self.partition_files is None or ('reduce', task, instance.id) in self._staged:
+            return
+        self.data_processor.put_worker_file(instance, self.partition_files[task], f'reducer_input_{task}.txt')
+        self.report.add_bytes(phase, instance.id, os.path.getsize(self.partition_files[task]))
+        self._staged.add(('reduce', task, instance.id))
+
+    def _deploy(self, instance, file_name, phase='deploy'):
+        """Upload a file to an instance and account for its size"""
+        self.instance_manager.deploy_code(instance, file_name)
+        self.report.add_bytes(phase, instance.id, os.path.getsize(file_name))
+
+    def _collect_worker_stats(self, phase, placement, stats_name):
+        """
+        Attach the stats sidecar files written by each map or reduce task that
+        ran to the report, and return the ones that could be read
+        """
+        records = 0
+        worker_stats = []
+        for i, instance in placement.items():
+            try:
+                with self.data_processor.open_worker_file(instance, stats_name.format(i), 'rb') as f:
+                    stats = json.loads(f.read())
+            except Exception as e:
+                print(f"Could not read stats of task {i} from {instance.id}: {e}")
+                continue
+            self.report.add_worker_stats(phase, instance.id, stats, task=i)
+            records += stats.get('records_emitted', stats.get('users_emitted', 0))
+            worker_stats.append(stats)
+        self.report.set_counts(phase, records_emitted=records)
+        return worker_stats
+
+    def _report_estimated_error(self, reducer_stats):
+        """
+        Report the standard error of an approximate run's mutual friend counts
+        relative to the counts, over every candidate pair the reducers estimated
+        """
+        counts = sum(stats.get('estimated_count', 0) for stats in reducer_stats)
+        std_error = sum(stats.get('estimated_std_error', 0.0) for stats in reducer_stats)
+        error = std_error / counts if counts else 0.0
+        self.report.set_counts('reduce', estimated_relative_error=round(error, 6))
+        print(f"Approximate counts (sample degree {self.sample_degree}): "
+              f"estimated relative error {error:.2%}")
+
+    def _timed_iter(self, phase, iterable):
+        """Pass items through while charging the time spent producing them to phase"""
+        iterator = iter(iterable)
+        elapsed = 0.0
+        count = 0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    elapsed += time.perf_counter() - start
+                count += 1
+                yield item
+        finally:
+            self.report.set_counts(phase, seconds=round(elapsed, 4), records_consumed=count)
+
+    def _shuffle_through_orchestrator(self):
+        """Pull every map task's output to this host and partition it into one sorted file per reduce task"""
+        report = self.report
+        # Collect and process mapper outputs; collection streams into the partitioner
+        print("Collecting and partitioning mapper outputs...")
+        all_mapper_outputs = self._timed_iter(
+            'collect', self.data_processor.collect_mapper_outputs(self.map_placement))
+        with report.phase('partition'):
+            partition_files = self.data_processor.partition_mapper_outputs(
+                all_mapper_outputs, self.reduce_tasks, self.partition_mode)
+        # The partition phase timer also ran while records were being collected
+        report.set_counts('partition', seconds=round(
+            report.phases['partition']['seconds'] - report.phases['collect']['seconds'], 4))
+        report.add_bytes_by_instance('collect', self.data_processor.bytes_transferred['collect'])
+        report.set_counts('partition', **self.data_processor.shuffle_stats)
+        report.set_counts('partition', partition_bytes=[os.path.getsize(path) for path in partition_files])
+        self.partition_files = partition_files
+
+    def _provision_instances(self, n_mappers=None, n_reducers=None):
+        """Launch, set up and deploy code to every mapper and reducer concurrently"""
+        n_mappers = self.n_mappers if n_mappers is None else n_mappers
+        n_reducers = self.n_reducers if n_reducers is None else n_reducers
+        roles = {'Mapper': (n_mappers, MAPPER_FILES), 'Reducer': (n_reducers, REDUCER_FILES)}
+        slots = {role: [None] * count for role, (count, _) in roles.items()}
+        tasks = [(role, i) for role, (count, _) in roles.items() for i in range(count)]
+
+        def provision(task):
+            role, i = task
+            start = time.perf_counter()
+            instance = self.instance_manager.launch_instance(name=f"{role} {i+1}")
+            slots[role][i] = instance
+            self.report.add_instance_seconds('provision', instance.id, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            self.instance_manager.setup_instance(instance)
+            self.report.add_instance_seconds('setup', instance.id, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            for file_name in roles[role][1]:
+                self._deploy(instance, file_name)
+            self.report.add_instance_seconds('deploy', instance.id, time.perf_counter() - start)
 
-    def run_mapreduce(self):
-        """Execute MapReduce job"""
         try:
-            # Launch and setup mapper instances
-            print("Launching mapper instances...")
-            for i in range(self.n_mappers):
-                instance_name = f"Mapper {i+1}"
-                instance = self.instance_manager.launch_instance(name=instance_name)
-                self.instance_manager.setup_instance(instance)
-                self.instance_manager.deploy_code(instance, 'mapper.py')
-                self.mapper_instances.append(instance)
-            
-            # Launch and setup reducer instances
-            print("Launching reducer instances...")
-            for i in range(self.n_reducers):
-                instance_name = f"Reducer {i+1}"
-                instance = self.instance_manager.launch_instance(name=instance_name)
-                self.instance_manager.setup_instance(instance)
-                self.instance_manager.deploy_code(instance, 'reducer.py')
-                self.reducer_instances.append(instance)
-            
-            # Split and distribute input data
-            splits = self.data_processor.split_input_file(self.input_file, self.n_mappers)
-            for i, instance in enumerate(self.mapper_instances):
-                split_file = f'split_{i}.txt'
-                with open(split_file, 'w') as f:
-                    f.writelines(splits[i])
-                self.instance_manager.deploy_code(instance, split_file)
-            
-            # Run mappers
-            print("Running mappers...")
-            for i, instance in enumerate(self.mapper_instances):
-                self.instance_manager.run_ssh_command(
-                    instance,
-                    f'python3 /home/ubuntu/mapper.py < /home/ubuntu/split_{i}.txt > /home/ubuntu/mapper_output_{i}.txt'
+            with self.report.phase('provision'):
+                self._run_concurrently('Provisioning', tasks, provision, label=lambda task: f"{task[0]} {task[1]+1}")
+        finally:
+            # Keep whatever was launched so cleanup can terminate it
+            self.mapper_instances = [instance for instance in slots['Mapper'] if instance is not None]
+            self.reducer_instances = [instance for instance in slots['Reducer'] if instance is not None]
+            # Setup and deploy overlap across instances; report their critical path
+            for phase in ('setup', 'deploy'):
+                seconds = [entry.get('seconds', 0.0) for entry in self.report.phases.get(phase, {}).get('instances', {}).values()]
+                self.report.set_counts(phase, seconds=max(seconds, default=0.0))
+
+    def _plan_splits(self):
+        """
+        Work out the input of every map task, and how to upload it to an
+        instance when workers cannot read this host's files. Returns a
+        content digest of each task's input when checkpointing.
+        """
+        report = self.report
+        digests = None
+        if self.split_strategy == 'cost':
+            # Cost-based splits are byte ranges plus hub shards, so they are always uploaded
+            splits = self.data_processor.split_by_cost(self.input_file, self.map_tasks)
+            self._send_split = lambda task, instance: self.data_processor.send_split_pieces(
+                instance, self.input_file, splits[task], f'split_{task}.txt')
+            report.set_counts('split', split_pieces=splits)
+            if self.checkpoints is not None:
+                digests = [pieces_digest(self.input_file, split) for split in splits]
+        elif self.graph_store:
+            from graph_store import GraphStore, ensure_graph_store
+            # Built once per input file and reused while the file is unchanged
+            self.graph_store_path = ensure_graph_store(self.input_file)
+            with GraphStore(self.graph_store_path) as store:
+                ranges = store.row_ranges(self.map_tasks, 'rows' if self.split_strategy == 'lines' else 'edges')
+            if self.data_processor.reads_input_directly:
+                self.input_ranges = ranges
+            else:
+                self._send_split = lambda task, instance: self.data_processor.send_graph_slice(
+                    instance, self.graph_store_path, ranges[task], f'split_{task}.csr')
+            report.set_counts('split', row_ranges=ranges)
+            if self.checkpoints is not None:
+                digests = [graph_rows_digest(self.graph_store_path, rows) for rows in ranges]
+        else:
+            ranges = self.data_processor.split_ranges(self.input_file, self.map_tasks, self.split_strategy)
+            if self.data_processor.reads_input_directly:
+                self.input_ranges = ranges
+            else:
+                self._send_split = lambda task, instance: self.data_processor.send_split_range(
+                    instance, self.input_file, ranges[task], f'split_{task}.txt')
+            report.set_counts('split', byte_ranges=ranges)
+            if self.checkpoints is not None:
+                digests = [range_digest(self.input_file, *byte_range) for byte_range in ranges]
+        return digests
+
+    def _plan_tasks(self, split_digests):
+        """
+        Decide which map and reduce tasks must run. Without a checkpoint store
+        that is every task. With one, a task is skipped when its output is
+        checkpointed, and map tasks are skipped altogether when every missing
+        reduce task's partition is checkpointed.
+        """
+        map_tasks, reduce_tasks = list(range(self.map_tasks)), list(range(self.reduce_tasks))
+        if self.checkpoints is None:
+            return map_tasks, reduce_tasks
+
+        code = code_version(MAPPER_FILES + REDUCER_FILES)
+        targets = range_digest(self.query_file, 0, os.path.getsize(self.query_file)) if self.query_file else None
+        # Only options that change a phase's output bytes are part of its key
+        mapper_options = {'format': self.record_format, 'combine': self.combine, 'vectorized': self.vectorized,
+                          'codec': self.codec, 'targets': targets, 'graph_store': self.graph_store,
+                          'sample_degree': self.sample_degree}
+        if self.shuffle_store:
+            mapper_options.update(partitions=self.reduce_tasks, partition_mode=self.partition_mode)
+        self.map_keys = [f"map/{digest('map', code, split, mapper_options)}" for split in split_digests]
+        shuffle_options = {'format': self.record_format, 'codec': self.codec, 'partitions': self.reduce_tasks,
+                           'partition_mode': self.partition_mode}
+        self.partition_keys = [f"partition/{digest('partition', code, self.map_keys, shuffle_options, r)}"
+                               for r in reduce_tasks]
+        reducer_options = {'format': self.record_format, 'codec': self.codec, 'top_k': self.top_k,
+                           'streaming': self.streaming_reducer, 'targets': targets,
+                           'partition_mode': self.partition_mode, 'approximate': bool(self.sample_degree)}
+        self.reduce_keys = [f"reduce/{digest('reduce', code, self.partition_keys[r], reducer_options)}"
+                            for r in reduce_tasks]
+
+        reduce_todo = [r for r in reduce_tasks if not self.checkpoints.has(self.reduce_keys[r])]
+        if not reduce_todo:
+            map_todo = []
+        elif self.shuffle_store is None and all(self.checkpoints.has(self.partition_keys[r]) for r in reduce_todo):
+            map_todo = []
+        else:
+            map_todo = [t for t in map_tasks if not self.checkpoints.has(self._map_checkpoint(t))]
+        self.report.set_counts('checkpoint', map_tasks_skipped=self.map_tasks - len(map_todo),
+                               reduce_tasks_skipped=self.reduce_tasks - len(reduce_todo))
+        print(f"Checkpoints: {len(map_todo)}/{self.map_tasks} map tasks and "
+              f"{len(reduce_todo)}/{self.reduce_tasks} reduce tasks to run")
+        return map_todo, reduce_todo
+
+    def _map_checkpoint(self, task):
+        """Checkpoint key that is written last for a map task's output"""
+        if self.shuffle_store:
+            return f'{self.map_keys[task]}/part_{self.reduce_tasks - 1}'
+        return self.map_keys[task]
+
+    def _run_map_tasks(self, tasks):
+        """Stage and run the map tasks, checkpointing the output of those that ran"""
+        report = self.report
+        placement = {}
+        if tasks:
+            if self._send_split is not None:
+                with report.phase('split'):
+                    preferred = self._preferred_instance(self.mapper_instances)
+                    self._run_concurrently(
+                        'Split upload',
+                        tasks,
+                        lambda task: self._stage_split(task, preferred(task)),
+                        label=lambda task: f"split {task}"
+                    )
+            print(f"Running {len(tasks)} map tasks on {len(self.mapper_instances)} mappers...")
+            with report.phase('map'):
+                placement = self._schedule(
+                    'Map',
+                    self.mapper_instances,
+                    tasks,
+                    lambda i, instance: self._worker_command(instance, 'mapper.py', self._mapper_input(i), f'mapper_output_{i}.txt',
+                                                             self._mapper_args(i, instance)),
+                    stage=self._stage_split
                 )
-            
-            # Collect and process mapper outputs
-            print("Collecting mapper outputs...")
-            all_mapper_outputs = self.data_processor.collect_mapper_outputs(self.mapper_instances)
-            
-            print("Partitioning mapper outputs...")
-            partitions = self.data_processor.partition_mapper_outputs(all_mapper_outputs, self.n_reducers)
-            
-            # Distribute to reducers
-            print("Distributing data to reducers...")
-            self.data_processor.distribute_to_reducers(partitions, self.reducer_instances)
-            
-            # Run reducers
-            print("Running reducers...")
-            for i, instance in enumerate(self.reducer_instances):
-                self.instance_manager.run_ssh_command(
-                    instance,
-                    f'python3 /home/ubuntu/reducer.py < /home/ubuntu/reducer_input_{i}.txt > /home/ubuntu/reducer_output_{i}.txt'
+            # Includes splits uploaded during the map phase to instances other than their preferred one
+            report.add_bytes_by_instance('split', self.data_processor.bytes_transferred['split'])
+            self._collect_worker_stats('map', placement, 'mapper_stats_{}.json')
+        self.map_placement = [placement.get(t) for t in range(self.map_tasks)]
+
+        if self.checkpoints is None or not placement:
+            return
+        with report.phase('checkpoint'):
+            for t, instance in placement.items():
+                if self.shuffle_store:
+                    # Mappers pushed their partitions to the shuffle store; copy them from there
+                    path = self.checkpoints.local_path(f'map_{t}_part')
+                    for r in range(self.reduce_tasks):
+                        self.shuffle.get(partition_key(t, r), path)
+                        self.checkpoints.save(path, f'{self.map_keys[t]}/part_{r}')
+                    os.remove(path)
+                else:
+                    # This download is the collect step; the shuffle then reads the local copy
+                    name = f'mapper_output_{t}.txt'
+                    path = self.checkpoints.local_path(name)
+                    self.data_processor.fetch_worker_file(instance, name, path)
+                    self.checkpoints.save(path, self.map_keys[t])
+                    self.map_placement[t] = LocalCopy(path)
+
+    def _prepare_reduce_inputs(self, tasks):
+        """Make each reduce task's partition available: shuffle, or restore it from checkpoints"""
+        report = self.report
+        if self.shuffle_store is not None:
+            if self.checkpoints is not None:
+                # Put checkpointed map outputs back where reducers fetch them
+                with report.phase('checkpoint'):
+                    path = self.checkpoints.local_path('restored_part')
+                    for t in range(self.map_tasks):
+                        if self.map_placement[t] is None:
+                            for r in range(self.reduce_tasks):
+                                self.checkpoints.store.get(f'{self.map_keys[t]}/part_{r}', path)
+                                self.shuffle.put(path, partition_key(t, r))
+                            self.checkpoints.hits += 1
+            print(f"Mappers pushed their partitions to {self.shuffle_store}")
+            return
+
+        if self.checkpoints is not None and all(self.checkpoints.has(self.partition_keys[r]) for r in tasks):
+            with report.phase('checkpoint'):
+                self.partition_files = [None] * self.reduce_tasks
+                for r in tasks:
+                    self.partition_files[r] = self.checkpoints.fetch(self.partition_keys[r], f'reducer_input_{r}.txt').path
+        else:
+            if self.checkpoints is not None:
+                with report.phase('checkpoint'):
+                    for t in range(self.map_tasks):
+                        if self.map_placement[t] is None:
+                            self.map_placement[t] = self.checkpoints.fetch(self.map_keys[t], f'mapper_output_{t}.txt')
+            self._shuffle_through_orchestrator()
+            if self.checkpoints is not None:
+                with report.phase('checkpoint'):
+                    for r, path in enumerate(self.partition_files):
+                        self.checkpoints.save(path, self.partition_keys[r])
+
+        # Distribute to reducers, round-robin; reduce tasks scheduled elsewhere fetch theirs on demand
+        print("Distributing data to reducers...")
+        with report.phase('distribute'):
+            preferred = self._preferred_instance(self.reducer_instances)
+            self._run_concurrently(
+                'Distribute',
+                tasks,
+                lambda task: self._stage_partition(task, preferred(task), 'distribute'),
+                label=lambda task: f"partition {task}"
+            )
+
+    def _run_reduce_tasks(self, tasks):
+        """Run the reduce tasks and checkpoint their output; skipped tasks are read from checkpoints"""
+        report = self.report
+        placement = {}
+        if tasks:
+            print(f"Running {len(tasks)} reduce tasks on {len(self.reducer_instances)} reducers...")
+            with report.phase('reduce'):
+                placement = self._schedule(
+                    'Reduce',
+                    self.reducer_instances,
+                    tasks,
+                    lambda i, instance: self._worker_command(instance, 'reducer.py', self._reducer_input(i), f'reducer_output_{i}.txt',
+                                                             self._reducer_args(i, instance)),
+                    stage=self._stage_partition
                 )
-            
+            reducer_stats = self._collect_worker_stats('reduce', placement, 'reducer_stats_{}.json')
+            if self.sample_degree:
+                self._report_estimated_error(reducer_stats)
+        self.reduce_placement = [placement.get(r) for r in range(self.reduce_tasks)]
+
+        if self.checkpoints is None:
+            return
+        with report.phase('checkpoint'):
+            for r in range(self.reduce_tasks):
+                name = f'reducer_output_{r}.txt'
+                if r in placement:
+                    path = self.checkpoints.local_path(name)
+                    self.data_processor.fetch_worker_file(placement[r], name, path, 'merge')
+                    self.checkpoints.save(path, self.reduce_keys[r])
+                    self.reduce_placement[r] = LocalCopy(path)
+                else:
+                    self.reduce_placement[r] = self.checkpoints.fetch(self.reduce_keys[r], name)
+
+    def run_mapreduce(self):
+        """Execute MapReduce job"""
+        report = self.report
+        try:
+            # Build the target users and their neighbourhood for a targeted query
+            if self.target_users:
+                print("Building query scope for target users...")
+                with report.phase('deploy'):
+                    self.query_file = self.data_processor.build_query_file(self.input_file, self.target_users)
+
+            # Split the input into map tasks, then find the tasks whose output is not checkpointed
+            with report.phase('split'):
+                split_digests = self._plan_splits()
+            map_tasks, reduce_tasks = self._plan_tasks(split_digests)
+
+            # Launch and setup only the instances that have tasks to run
+            print("Launching mapper and reducer instances...")
+            self._provision_instances(self.n_mappers if map_tasks else 0, self.n_reducers if reduce_tasks else 0)
+
+            # Broadcast the query file
+            if self.query_file:
+                with report.phase('deploy'):
+                    self._run_concurrently(
+                        'Query upload',
+                        self.mapper_instances + self.reducer_instances,
+                        lambda instance: self._deploy(instance, self.query_file),
+                        label=lambda instance: instance.id
+                    )
+
+            self._run_map_tasks(map_tasks)
+            if reduce_tasks:
+                self._prepare_reduce_inputs(reduce_tasks)
+            self._run_reduce_tasks(reduce_tasks)
+            if self.checkpoints is not None:
+                report.set_counts('checkpoint', hits=self.checkpoints.hits, saved=self.checkpoints.saved)
+
             # Collect and process final results
             print("Collecting and processing final results...")
-            self.data_processor.collect_and_process_results(self.reducer_instances)
+            with report.phase('merge'):
+                self.data_processor.collect_and_process_results(
+                    self.reduce_placement, self.target_users, self.partition_mode)
+            report.add_bytes_by_instance('merge', self.data_processor.bytes_transferred['merge'])
+            report.status = 'succeeded'
 
         except Exception as e:
+            report.status = 'failed'
+            report.error = str(e)
             print(f"Error in MapReduce job: {e}")
             raise
+        finally:
+            if self.checkpoints is not None:
+                self.checkpoints.close()
+            if self.connection_pool is not None:
+                self.connection_pool.close_all()
+            if self.report_file:
+                report.write(self.report_file)
+                print(f"Run report written to {self.report_file}")
 
     def cleanup(self):
         """Cleanup all AWS resources"""
+        if self.shuffle is not None:
+            # Only the partitions this job wrote; the store may hold other data
+            self.shuffle.remove([partition_key(j, r) for j in range(self.map_tasks) for r in range(self.reduce_tasks)])
+        if self.aws_manager is None:
+            self.instance_manager.terminate_instances(self.mapper_instances + self.reducer_instances)
+            return
         instance_ids = [i.id for i in self.mapper_instances + self.reducer_instances]
         self.aws_manager.cleanup_resources(instance_ids)
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run the friend recommendation MapReduce job')
+    parser.add_argument('--input', default='soc-LiveJournal1Adj.txt', help='Adjacency list input file')
+    parser.add_argument('--mappers', type=int, default=3, help='Number of mapper workers')
+    parser.add_argument('--reducers', type=int, default=2, help='Number of reducer workers')
+    parser.add_argument('--backend', choices=['ec2', 'local'], default='ec2',
+                        help='Run workers on EC2 instances or as local processes')
+    parser.add_argument('--work-dir', default='local_workers', help='Scratch directory for the local backend')
+    parser.add_argument('--combine', action='store_true',
+                        help='Aggregate mutual friend counts in the mappers to shrink the shuffle')
+    parser.add_argument('--record-format', choices=['text', 'binary'], default='text',
+                        help='Intermediate record format used for the shuffle')
+    parser.add_argument('--vectorized', action='store_true',
+                        help='Build mapper output in bulk with NumPy; needs --record-format binary')
+    parser.add_argument('--sample-degree', type=int,
+                        help='Approximate mode: pair up a deterministic sample of this many friends of any '
+                             'user with more, bounding mapper work and shuffle bytes per user')
+    parser.add_argument('--targets', help='Comma-separated users; only compute their recommendations')
+    parser.add_argument('--top-k', type=int, default=10, help='Recommendations kept per user')
+    parser.add_argument('--streaming-reducer', action='store_true',
+                        help='Reducers keep a bounded top-k heap per user')
+    parser.add_argument('--split-strategy', choices=['lines', 'bytes', 'cost'], default='lines',
+                        help='Split the input by line count, by size or by estimated mapper work')
+    parser.add_argument('--partition-mode', choices=['pair', 'user'], default='pair',
+                        help='Route shuffle records by pair, or by user so reducer output is final')
+    parser.add_argument('--codec', choices=['none', 'gzip', 'bz2', 'lzma'], default='none',
+                        help='Compress splits, mapper output, reducer input and reducer output in transit')
+    parser.add_argument('--compression-level', type=int, help='Compression level for --codec')
+    parser.add_argument('--shuffle-store',
+                        help='Shuffle through this store (s3://bucket/prefix or a shared directory) '
+                             'instead of through this host')
+    parser.add_argument('--instance-profile', help='IAM instance profile for the workers, e.g. for S3 access')
+    parser.add_argument('--graph-store', action='store_true',
+                        help='Map from a cached binary CSR copy of the input instead of its text')
+    parser.add_argument('--map-tasks', type=int,
+                        help='Number of map tasks handed out to the mappers (default: one per mapper)')
+    parser.add_argument('--reduce-tasks', type=int,
+                        help='Number of reduce tasks (partitions) handed out to the reducers (default: one per reducer)')
+    parser.add_argument('--max-attempts', type=int, default=3,
+                        help='Attempts per task before the phase fails; retries go to another instance')
+    parser.add_argument('--speculative', action='store_true',
+                        help='Run backup copies of slow tasks on idle instances once no tasks are queued')
+    parser.add_argument('--workers-per-node', type=int,
+                        help='Processes each mapper and reducer splits its work across '
+                             '(default: every core on EC2, one for the local backend)')
+    parser.add_argument('--checkpoint-store',
+                        help='Save phase outputs here (s3://bucket/prefix or a directory) and skip tasks '
+                             'whose output is already saved, e.g. s3://mapreduce-socialnetwork/checkpoints')
+    parser.add_argument('--report', default='run_report.json', help='Where to write the JSON run report')
+    parser.add_argument('--max-concurrency', type=int, default=16,
+                        help='Instances provisioned or driven at the same time')
+    parser.add_argument('--shuffle-memory-budget', type=int, default=500000,
+                        help='Intermediate records held in memory before the shuffle spills to disk')
+    return parser.parse_args()
+
 def main():
-    input_file = 'soc-LiveJournal1Adj.txt'  # Your input file
-    n_mappers = 3
-    n_reducers = 2
-    
-    orchestrator = MapReduceOrchestrator(input_file, n_mappers, n_reducers)
-    
+    args = parse_args()
+
+    orchestrator = MapReduceOrchestrator(args.input, args.mappers, args.reducers,
+                                         backend=args.backend, work_dir=args.work_dir,
+                                         combine=args.combine, record_format=args.record_format,
+                                         shuffle_memory_budget=args.shuffle_memory_budget,
+                                         max_concurrency=args.max_concurrency,
+                                         target_users=args.targets.split(',') if args.targets else None,
+                                         top_k=args.top_k, streaming_reducer=args.streaming_reducer,
+                                         report_file=args.report, split_strategy=args.split_strategy,
+                                         partition_mode=args.partition_mode, codec=args.codec,
+                                         compression_level=args.compression_level,
+                                         shuffle_store=args.shuffle_store, instance_profile=args.instance_profile,
+                                         graph_store=args.graph_store, map_tasks=args.map_tasks,
+                                         reduce_tasks=args.reduce_tasks, max_attempts=args.max_attempts,
+                                         speculative=args.speculative, vectorized=args.vectorized,
+                                         workers_per_node=args.workers_per_node,
+                                         checkpoint_store=args.checkpoint_store,
+                                         sample_degree=args.sample_degree)
+
     try:
         orchestrator.run_mapreduce()
     except Exception as e:
         print(f"Error in main: {e}")
     finally:
-        # Ask user about cleanup
-        delete = input("Do you want to terminate all instances and cleanup resources? (yes/no): ").strip().lower()
-        if delete == 'yes':
+        if args.backend == 'local':
+            # Local scratch directories are cheap to recreate
             orchestrator.cleanup()
         else:
-            print("Instances and resources are left running.")
+            # Ask user about cleanup
+            delete = input("Do you want to terminate all instances and cleanup resources? (yes/no): ").strip().lower()
+            if delete == 'yes':
+                orchestrator.cleanup()
+            else:
+                print("Instances and resources are left running.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
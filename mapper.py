@@ -1,41 +1,506 @@
 # mapper.py
+import argparse
+import io
+import math
+import os
 import sys
+import time
+from bisect import bisect_left
 
-def map_friends():
+from records import (CODECS, DIRECT, FORMATS, MAX_WEIGHT, MIN_SAMPLE_DEGREE, PARTITION_MODES, WEIGHT_SCALE,
+                     RecordWriter, id_type, pair_key, read_query_file, wrap_stream)
+
+# Pairs built at once by the vectorized mapper
+PAIR_CHUNK = 1 << 20
+
+# Input ranges per worker process, so a range full of hubs does not hold up the node
+PARTS_PER_WORKER = 4
+
+MASK64 = (1 << 64) - 1
+
+def read_adjacency(stream, fmt='text', scope=None, stats=None):
     """
-    Mapper function that processes the input file and emits key-value pairs.
-    For each user and their friends, emits:
-    1. Direct friendships (user, friend) -> 'direct'
-    2. Potential friendships (friend1, friend2) -> user (mutual friend)
+    Yield (user, friends, rows) for every well-formed adjacency line.
+    rows is the (lo, hi) range of a hub shard written by the cost-based
+    splitter, or None for a whole line.
+    If scope is given, lines of users outside it are skipped before their
+    friend list is parsed. Lines read are counted into stats if given.
     """
-    for line in sys.stdin:
+    to_id = id_type(fmt)
+    if stats is None:
+        stats = {}
+    stats.setdefault('lines_read', 0)
+    for line in stream:
+        stats['lines_read'] += 1
         # Skip empty lines
         if not line.strip():
             continue
 
         # Parse input line
         parts = line.strip().split('\t')
-        if len(parts) != 2:
+        if len(parts) not in (2, 3):
             continue
 
-        user = parts[0]
-        friends = parts[1].split(',')
+        user = to_id(parts[0])
+        if scope is not None and user not in scope:
+            continue
 
-        # Emit direct friendships
-        for friend in friends:
-            if friend:
-                # Emit both (user, friend) and (friend, user) since friendships are mutual
-                key = '\t'.join(sorted([user, friend]))
-                print(f"{key}\tdirect")
+        rows = tuple(int(bound) for bound in parts[2].split(':')) if len(parts) == 3 else None
+        yield user, [to_id(friend) for friend in parts[1].split(',') if friend], rows
 
-        # Emit potential friendships (mutual friends)
-        for i in range(len(friends)):
+def read_graph_store(path, fmt='text', rows=None, scope=None, stats=None):
+    """
+    Yield (user, friends, None) like read_adjacency, but from the rows of a
+    binary graph store (see graph_store.py) instead of parsed text.
+    """
+    from graph_store import GraphStore
+    to_id = id_type(fmt)
+    if stats is None:
+        stats = {}
+    stats.setdefault('lines_read', 0)
+    start, end = rows or (None, None)
+    with GraphStore(path) as store:
+        for user, view in store.rows(start, end):
+            stats['lines_read'] += 1
+            # Release every row view so the store can be unmapped at the end
+            with view:
+                if scope is not None and to_id(user) not in scope:
+                    continue
+                friends = view.tolist()
+            if fmt == 'binary':
+                yield user, friends, None
+            else:
+                yield str(user), [str(friend) for friend in friends], None
+
+def read_byte_range(path, start, end):
+    """Yield the lines of a file between two byte offsets that fall on line starts."""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        for line in f:
+            if remaining <= 0:
+                break
+            remaining -= len(line)
+            yield line.decode()
+
+def candidate_pairs(friends, targets=None, rows=None):
+    """
+    Yield every unordered pair of friends in the list.
+    With rows=(lo, hi), only pairs whose first friend index is in [lo, hi).
+    With targets, only pairs involving at least one target are produced,
+    in time proportional to the number of targets in the list.
+    """
+    lo, hi = rows or (0, len(friends))
+    if targets is None:
+        for i in range(lo, min(hi, len(friends))):
             for j in range(i + 1, len(friends)):
-                friend1 = friends[i]
-                friend2 = friends[j]
-                if friend1 and friend2:
-                    key = '\t'.join(sorted([friend1, friend2]))
-                    print(f"{key}\t{user}")
+                yield friends[i], friends[j]
+        return
+
+    for i, friend in enumerate(friends):
+        if friend not in targets:
+            continue
+        for j, other in enumerate(friends):
+            # Pairs of two targets are produced once, from the earlier one
+            if j == i or (j < i and other in targets):
+                continue
+            if lo <= min(i, j) < hi:
+                yield friend, other
+
+def sample_hash(user, friend):
+    """Deterministic 64-bit hash of an edge (the splitmix64 finalizer), the same in every process."""
+    x = (int(user) << 32 | int(friend)) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
+def pair_weight(degree, sample_degree):
+    """
+    Weight of every pair a sampled user emits, in WEIGHT_SCALE units: the
+    inverse of the chance that both friends of a pair are among those kept.
+    Raises ValueError when the weight does not fit in a record.
+    """
+    weight = round(WEIGHT_SCALE * degree * (degree - 1) / (sample_degree * (sample_degree - 1)))
+    if weight > MAX_WEIGHT:
+        # Smallest T with T(T - 1) >= WEIGHT_SCALE * degree * (degree - 1) / MAX_WEIGHT
+        needed = math.ceil((1 + math.sqrt(1 + 4 * WEIGHT_SCALE * degree * (degree - 1) / MAX_WEIGHT)) / 2)
+        raise ValueError(f"A user with {degree} friends needs a sample degree of at least {needed}, "
+                         f"got {sample_degree}")
+    return weight
+
+def sample_friends(user, friends, sample_degree, rows=None):
+    """
+    Keep the sample_degree friends with the lowest sample hashes, in list
+    order, when a user has more. Every shard of a hub keeps the same friends,
+    and rows is mapped onto the kept list. Returns (friends, rows, weight),
+    weight being what each of their pairs counts for in WEIGHT_SCALE units.
+    """
+    if sample_degree is None or len(friends) <= sample_degree:
+        return friends, rows, WEIGHT_SCALE
+    keep = sorted(sorted(range(len(friends)), key=lambda i: sample_hash(user, friends[i]))[:sample_degree])
+    if rows is not None:
+        rows = (bisect_left(keep, rows[0]), bisect_left(keep, rows[1]))
+    return [friends[i] for i in keep], rows, pair_weight(len(friends), sample_degree)
+
+def sample_friends_array(user, friends, sample_degree, rows=None):
+    """sample_friends for a NumPy array of friends, keeping the same ones."""
+    import numpy as np
+    if sample_degree is None or len(friends) <= sample_degree:
+        return friends, rows, WEIGHT_SCALE
+    x = (np.uint64(user) << np.uint64(32)) | friends.astype(np.uint64)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    keep = np.sort(np.argsort(x, kind='stable')[:sample_degree])
+    if rows is not None:
+        rows = tuple(int(bound) for bound in np.searchsorted(keep, rows))
+    return friends[keep], rows, pair_weight(len(friends), sample_degree)
+
+def count_sampled(stats, friends, sampled):
+    if stats is not None and len(sampled) < len(friends):
+        stats['sampled_users'] = stats.get('sampled_users', 0) + 1
+
+def involves_target(user, friend, targets):
+    return targets is None or user in targets or friend in targets
+
+def map_friends(fmt='text', targets=None, scope=None, stats=None, input_stream=None, writer=None, adjacency=None,
+                sample_degree=None):
+    """
+    Mapper function that processes the input file and emits key-value pairs.
+    For each user and their friends, emits:
+    1. Direct friendships (user, friend) -> 'direct'
+    2. Potential friendships (friend1, friend2) -> user (mutual friend)
+    With targets, only pairs involving a target user are emitted.
+    With sample_degree, users with more friends only pair up a deterministic
+    sample of them (see sample_friends), bounding the pairs any user emits,
+    and every pair is a count record weighted for the pairs left out.
+    Reads stdin and writes records to stdout unless a stream and writer are given;
+    adjacency replaces the parsed input with (user, friends, rows) items.
+    """
+    writer = writer or RecordWriter(sys.stdout.buffer, fmt)
+    adjacency = adjacency or read_adjacency(input_stream or sys.stdin, fmt, scope, stats)
+    for user, friends, rows in adjacency:
+        # Emit direct friendships, once per hub even when it is sharded
+        for friend in friends if not rows or rows[0] == 0 else ():
+            # Emit both (user, friend) and (friend, user) since friendships are mutual
+            if involves_target(user, friend, targets):
+                writer.write_direct(*pair_key(user, friend))
+
+        # Emit potential friendships (mutual friends)
+        sampled, sampled_rows, weight = sample_friends(user, friends, sample_degree, rows)
+        count_sampled(stats, friends, sampled)
+        for friend1, friend2 in candidate_pairs(sampled, targets, sampled_rows):
+            if sample_degree is None:
+                writer.write_mutual(*pair_key(friend1, friend2), user)
+            else:
+                writer.write_count(*pair_key(friend1, friend2), weight)
+    writer.close()
+    if stats is not None:
+        stats['records_emitted'] = writer.records_written
+
+def emit_combined(table, writer):
+    """Write every aggregated pair in the table and empty it."""
+    for (a, b), count in table.items():
+        if count == DIRECT:
+            writer.write_direct(a, b)
+        else:
+            writer.write_count(a, b, count)
+    table.clear()
+
+def map_friends_combined(max_entries=100000, fmt='text', targets=None, scope=None, stats=None,
+                         input_stream=None, writer=None, adjacency=None):
+    """
+    Mapper with an in-mapper combiner.
+    Instead of one record per mutual friend, keeps a bounded table of
+    (friend1, friend2) -> count and emits count records, plus a single
+    'direct' marker per directly connected pair. The table is spilled
+    whenever it reaches max_entries pairs.
+    """
+    writer = writer or RecordWriter(sys.stdout.buffer, fmt)
+    table = {}
+    adjacency = adjacency or read_adjacency(input_stream or sys.stdin, fmt, scope, stats)
+    for user, friends, rows in adjacency:
+        # Direct friendships override any mutual friend count
+        for friend in friends if not rows or rows[0] == 0 else ():
+            if not involves_target(user, friend, targets):
+                continue
+            if len(table) >= max_entries:
+                emit_combined(table, writer)
+            table[pair_key(user, friend)] = DIRECT
+
+        # Potential friendships (mutual friends)
+        for friend1, friend2 in candidate_pairs(friends, targets, rows):
+            key = pair_key(friend1, friend2)
+            count = table.get(key, 0)
+            if count == DIRECT:
+                continue
+            if count == 0 and len(table) >= max_entries:
+                emit_combined(table, writer)
+            table[key] = count + 1
+
+    emit_combined(table, writer)
+    writer.close()
+    if stats is not None:
+        stats['records_emitted'] = writer.records_written
+
+def upper_triangle_pairs(friends, lo=0, hi=None, chunk=PAIR_CHUNK):
+    """
+    Yield (first, second) NumPy arrays holding the pairs friends[i], friends[j]
+    with lo <= i < hi and i < j, about chunk pairs at a time so hub lists
+    never materialize all of their pairs at once. Each pair is ordered
+    numerically, first <= second.
+    """
+    import numpy as np
+    d = len(friends)
+    hi = d if hi is None else min(hi, d)
+    i = lo
+    while i < hi:
+        # Row i holds d - 1 - i pairs; take as many whole rows as fit in a chunk
+        counts = d - 1 - np.arange(i, hi)
+        end = i + max(1, int(np.searchsorted(np.cumsum(counts), chunk, side='right')))
+        rows, counts = np.arange(i, end), counts[:end - i]
+        i = end
+        total = int(counts.sum())
+        if total == 0:
+            continue
+        starts = np.cumsum(counts) - counts
+        first = np.repeat(rows, counts)
+        second = np.arange(total) - np.repeat(starts, counts) + first + 1
+        a, b = friends[first], friends[second]
+        yield np.minimum(a, b), np.maximum(a, b)
+
+def map_friends_vectorized(targets=None, scope=None, stats=None, input_stream=None, writer=None, adjacency=None,
+                           combine=False, max_entries=100000, sample_degree=None):
+    """
+    Binary-format mapper that emits the same records as map_friends (or
+    map_friends_combined with combine) but turns each friend list into an
+    integer array once and builds its pairs and records in bulk with NumPy,
+    writing whole arrays of records at a time.
+    With combine, pair keys are buffered until max_entries are held and then
+    counted with one np.unique; direct markers are written as they come.
+    sample_degree samples hubs as in map_friends; it cannot be combined.
+    """
+    import numpy as np
+    writer = writer or RecordWriter(sys.stdout.buffer, 'binary')
+    adjacency = adjacency or read_adjacency(input_stream or sys.stdin, 'binary', scope, stats)
+    pending, n_pending = [], 0
+
+    def emit(first, second, values):
+        writer.write_array(np.column_stack((first, second, np.broadcast_to(values, first.shape))))
+
+    def emit_pending():
+        keys = np.concatenate(pending)
+        pending.clear()
+        keys, counts = np.unique(keys, return_counts=True)
+        emit(keys >> 32, keys & 0xFFFFFFFF, counts)
+
+    for user, friends, rows in adjacency:
+        friends = np.array(friends, dtype=np.int64)
+        if not rows or rows[0] == 0:
+            direct = friends
+            if targets is not None:
+                direct = friends[[involves_target(user, friend, targets) for friend in friends.tolist()]]
+            emit(np.minimum(direct, user), np.maximum(direct, user), DIRECT)
+
+        sampled, sampled_rows, weight = sample_friends_array(user, friends, sample_degree, rows)
+        count_sampled(stats, friends, sampled)
+        if targets is None:
+            pairs = upper_triangle_pairs(sampled, *(sampled_rows or (0, None)))
+        else:
+            # Few pairs involve a target, so the generator is already cheap
+            targeted = np.array(list(candidate_pairs(sampled.tolist(), targets, sampled_rows)),
+                                dtype=np.int64).reshape(-1, 2)
+            pairs = [(targeted.min(axis=1), targeted.max(axis=1))]
+        for first, second in pairs:
+            if not combine:
+                emit(first, second, 1 if sample_degree is None else weight)
+                continue
+            pending.append((first << 32) | second)
+            n_pending += len(first)
+            if n_pending >= max_entries:
+                emit_pending()
+                n_pending = 0
+
+    if pending:
+        emit_pending()
+    writer.close()
+    if stats is not None:
+        stats['records_emitted'] = writer.records_written
+
+def run_mapper(args, targets, scope, stats, input_stream=None, writer=None, adjacency=None):
+    """Run the mapper variant chosen on the command line."""
+    if args.vectorized:
+        map_friends_vectorized(targets, scope, stats, input_stream, writer, adjacency, args.combine, args.max_entries,
+                               args.sample_degree)
+    elif args.combine:
+        map_friends_combined(args.max_entries, args.format, targets, scope, stats, input_stream, writer, adjacency)
+    else:
+        map_friends(args.format, targets, scope, stats, input_stream, writer, adjacency, args.sample_degree)
+
+def input_range(args):
+    """Byte range of --input to map: --byte-range, or the whole file."""
+    if args.byte_range:
+        return tuple(int(offset) for offset in args.byte_range.split(':'))
+    return 0, os.path.getsize(args.input)
+
+def graph_rows(args):
+    return tuple(int(row) for row in args.rows.split(':')) if args.rows else None
+
+def map_part(job):
+    """
+    Map one range of the input in a worker process. Records go to the part
+    file, or to sorted per-partition part files when shuffling through a store.
+    """
+    args, (start, end), part_path = job
+    stats = {}
+    targets, scope = read_query_file(args.targets, args.format) if args.targets else (None, None)
+    input_stream, adjacency = None, None
+    if args.graph:
+        adjacency = read_graph_store(args.graph, args.format, (start, end), scope, stats)
+    else:
+        input_stream = read_byte_range(args.input, start, end)
+    if args.shuffle_store:
+        from shuffle import PartitionWriter
+        writer = PartitionWriter([f'{part_path}_part_{r}' for r in range(args.partitions)], args.format,
+                                 args.partition_mode, args.memory_budget, temp_dir=os.path.dirname(part_path))
+        run_mapper(args, targets, scope, stats, input_stream, writer, adjacency)
+        stats['spilled_runs'] = writer.spilled_runs
+    else:
+        with open(part_path, 'wb') as f:
+            run_mapper(args, targets, scope, stats, input_stream, RecordWriter(f, args.format), adjacency)
+    return stats
+
+def map_in_parallel(args, stats, partition_files=None):
+    """
+    Divide this mapper's input among args.workers processes and combine
+    their output on the node: concatenated to stdout, or merged into the
+    sorted partition_files when shuffling through a store. Piped or
+    compressed input is spooled to a local file first so it can be divided.
+    """
+    import shutil
+    import tempfile
+    from intra_node import add_stats, line_ranges, run_parts, spool
+
+    work_dir = tempfile.mkdtemp(prefix='mapper_parts_', dir='.')
+    try:
+        n_parts = args.workers * PARTS_PER_WORKER
+        if args.graph:
+            from graph_store import GraphStore
+            with GraphStore(args.graph) as store:
+                ranges = store.row_ranges(n_parts, 'edges', *(graph_rows(args) or (0, None)))
+        else:
+            if args.input:
+                start, end = input_range(args)
+            else:
+                args.input = os.path.join(work_dir, 'input')
+                start, end = 0, spool(wrap_stream(sys.stdin.buffer, 'rb', args.codec), args.input)
+            ranges = line_ranges(args.input, n_parts, start, end)
+        jobs = [(args, rows, os.path.join(work_dir, f'part_{k}')) for k, rows in enumerate(ranges)]
+        for part_stats in run_parts(map_part, jobs, args.workers):
+            add_stats(stats, part_stats)
+        stats['workers'] = args.workers
+
+        part_paths = [part_path for _, _, part_path in jobs]
+        if partition_files is not None:
+            from shuffle import merge_sorted, write_run
+            for r, path in enumerate(partition_files):
+                write_run(merge_sorted([f'{part}_part_{r}' for part in part_paths], args.format), path,
+                          args.format, args.codec, args.compression_level)
+        else:
+            output_stream = wrap_stream(sys.stdout.buffer, 'wb', args.codec, args.compression_level)
+            for part in part_paths:
+                with open(part, 'rb') as f:
+                    shutil.copyfileobj(f, output_stream)
+            if output_stream is sys.stdout.buffer:
+                output_stream.flush()
+            else:
+                output_stream.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Friend recommendation mapper')
+    parser.add_argument('--combine', action='store_true',
+                        help='Aggregate mutual friend counts in memory before emitting')
+    parser.add_argument('--max-entries', type=int, default=100000,
+                        help='Pairs held by the combiner before it spills')
+    parser.add_argument('--format', choices=FORMATS, default='text',
+                        help='Intermediate record format')
+    parser.add_argument('--targets', help='Query file: only emit pairs involving its target users')
+    parser.add_argument('--vectorized', action='store_true',
+                        help='Build pairs and records in bulk with NumPy (binary format only)')
+    parser.add_argument('--sample-degree', type=int,
+                        help='Approximate mode: only pair up a deterministic sample of this many friends of '
+                             'users with more, emitting weighted counts (reduce with --approximate)')
+    parser.add_argument('--graph', help='Read friend lists from this binary graph store instead of stdin')
+    parser.add_argument('--rows', help='start:end row range of --graph to map')
+    parser.add_argument('--input', help='Read this file instead of stdin, used with --byte-range')
+    parser.add_argument('--byte-range', help='start:end byte offsets of the lines to read from --input')
+    parser.add_argument('--codec', choices=CODECS, default='none',
+                        help='Compression of the input split and of the output')
+    parser.add_argument('--compression-level', type=int, help='Compression level for the output')
+    parser.add_argument('--shuffle-store',
+                        help='Partition and sort the output here and push it to this store instead of stdout')
+    parser.add_argument('--map-index', type=int, default=0, help='Index of this mapper, used with --shuffle-store')
+    parser.add_argument('--partitions', type=int, default=1, help='Number of reducers, used with --shuffle-store')
+    parser.add_argument('--partition-mode', choices=PARTITION_MODES, default='pair',
+                        help='Route records by pair or by user, used with --shuffle-store')
+    parser.add_argument('--memory-budget', type=int, default=500000,
+                        help='Records held in memory before partitions spill, used with --shuffle-store')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Processes that share this mapper\'s input (default: one per core)')
+    parser.add_argument('--stats', help='Write timing and record counts to this JSON file')
+    args = parser.parse_args()
+    if args.workers is None:
+        from intra_node import default_workers
+        args.workers = default_workers()
+    return args
 
 if __name__ == "__main__":
-    map_friends()
\ No newline at end of file
+    args = parse_args()
+    if args.vectorized and args.format != 'binary':
+        sys.exit("--vectorized needs --format binary")
+    if args.sample_degree is not None:
+        if args.combine:
+            sys.exit("--sample-degree cannot be used with --combine")
+        if args.sample_degree < MIN_SAMPLE_DEGREE:
+            sys.exit(f"--sample-degree must be at least {MIN_SAMPLE_DEGREE}")
+    start = time.perf_counter()
+    stats = {}
+    partition_files = None
+    if args.shuffle_store:
+        partition_files = [f'mapper_output_{args.map_index}_part_{r}' for r in range(args.partitions)]
+    if args.workers > 1:
+        map_in_parallel(args, stats, partition_files)
+    else:
+        targets, scope = read_query_file(args.targets, args.format) if args.targets else (None, None)
+        input_stream = sys.stdin
+        if args.input:
+            input_stream = read_byte_range(args.input, *input_range(args))
+        elif args.codec != 'none':
+            input_stream = io.TextIOWrapper(wrap_stream(sys.stdin.buffer, 'rb', args.codec))
+        if args.shuffle_store:
+            from shuffle import PartitionWriter
+            writer = PartitionWriter(partition_files, args.format, args.partition_mode, args.memory_budget,
+                                     codec=args.codec, compression_level=args.compression_level)
+        else:
+            output_stream = wrap_stream(sys.stdout.buffer, 'wb', args.codec, args.compression_level)
+            writer = RecordWriter(output_stream, args.format)
+        adjacency = None
+        if args.graph:
+            adjacency = read_graph_store(args.graph, args.format, graph_rows(args), scope, stats)
+        run_mapper(args, targets, scope, stats, input_stream, writer, adjacency)
+        if args.shuffle_store:
+            stats['spilled_runs'] = writer.spilled_runs
+        elif args.codec != 'none':
+            output_stream.close()
+    if args.shuffle_store:
+        from shuffle import open_store, partition_key
+        store = open_store(args.shuffle_store)
+        stats['partition_bytes'] = [os.path.getsize(path) for path in partition_files]
+        for r, path in enumerate(partition_files):
+            store.put(path, partition_key(args.map_index, r))
+            os.remove(path)
+    if args.stats:
+        from run_report import write_worker_stats
+        write_worker_stats(args.stats, 'mapper', time.perf_counter() - start, stats)
@@ -0,0 +1,319 @@
+# query_service.py
+"""
+Long-running recommendation query service.
+
+The graph is loaded once into CSR arrays (see csr_engine.py). Each query runs
+the two-hop count for a single user: the friend lists that contain the user
+are gathered, their members counted, and the user's direct friends masked
+out, giving the same answers as the batch job for that user. Results are
+kept in a bounded LRU cache.
+
+Friendships can be added and removed while the service runs. Changes are
+kept in an overlay on top of the loaded arrays, and a change to u and v
+evicts the cached results that depend on it: those of u, v and everyone in
+u's or v's friend list, since their two-hop counts read those lists.
+
+    python query_service.py --input soc-LiveJournal1Adj.txt --port 8080
+    curl 'localhost:8080/recommendations/924?k=10'
+    curl --data-binary $'+ 924 8941\n- 924 43748\n' localhost:8080/friendships
+    curl localhost:8080/stats
+
+Pass --socket to listen on a Unix socket instead (curl --unix-socket).
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from csr_engine import gather_rows, load_adjacency, load_graph_store, rank_candidates, transpose_csr
+
+class LRUCache:
+    """Mapping that holds at most max_entries items, evicting the least recently used."""
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def discard(self, key):
+        return self.entries.pop(key, None) is not None
+
+    def __len__(self):
+        return len(self.entries)
+
+class RecommendationService:
+    """
+    Per-user recommendations over a graph held in memory. Every cached
+    result holds max_k recommendations; smaller k are served from it.
+    The lock guards the cache and the overlay only: a query copies the
+    overlay rows it needs under the lock and counts outside it, so a slow
+    query never holds up others. Each change bumps the version of the users
+    it affects, and a result whose user changed meanwhile is not cached.
+    """
+
+    def __init__(self, indptr, indices, max_k=10, cache_size=100000):
+        self.indptr, self.indices = indptr, indices
+        self.t_indptr, self.t_indices = transpose_csr(indptr, indices)
+        self.n_nodes = len(indptr) - 1
+        self.max_k = max_k
+        self.cache = LRUCache(cache_size)
+        self.lock = threading.Lock()
+        # Friend list changes since the graph was loaded, by list owner and by listed user
+        self.added = defaultdict(set)
+        self.removed = defaultdict(set)
+        self.added_in = defaultdict(set)
+        self.removed_in = defaultdict(set)
+        self.versions = defaultdict(int)
+        self.invalidations = 0
+
+    def _row(self, indptr, indices, added, removed, user):
+        """A row of the loaded arrays with the overlay applied."""
+        row = indices[indptr[user]:indptr[user + 1]] if user < self.n_nodes else indices[:0]
+        if user in removed:
+            row = row[~np.isin(row, list(removed[user]))]
+        if user in added:
+            row = np.concatenate((row, list(added[user])))
+        return row
+
+    def friends_of(self, user):
+        return self._row(self.indptr, self.indices, self.added, self.removed, user)
+
+    def listed_by(self, user):
+        """Users whose friend list contains user."""
+        return self._row(self.t_indptr, self.t_indices, self.added_in, self.removed_in, user)
+
+    def _snapshot(self, user):
+        """
+        Copy what a query for user reads from the overlay; called under the lock.
+        Lists without changes are read later from the loaded arrays, which never change.
+        """
+        containing = self.listed_by(user)
+        changed = [w for w in containing.tolist() if w in self.added or w in self.removed]
+        unchanged = containing[~np.isin(containing, changed)] if changed else containing
+        return containing, unchanged, [self.friends_of(w) for w in changed], self.friends_of(user)
+
+    def _compute(self, user, snapshot):
+        containing, unchanged, changed_rows, friends = snapshot
+        two_hop = np.concatenate([gather_rows(self.indptr, self.indices, unchanged)] + changed_rows)
+        direct = np.concatenate((friends, containing, [user]))
+        return rank_candidates(two_hop, direct, self.max_k, self.n_nodes)
+
+    def recommend(self, user, k=None):
+        """Return (recommendations, cached) for a user, best first."""
+        k = self.max_k if k is None else k
+        if not 0 <= k <= self.max_k:
+            raise ValueError(f"k must be between 0 and {self.max_k}")
+        with self.lock:
+            recommendations = self.cache.get(user)
+            if recommendations is not None:
+                return recommendations[:k], True
+            version = self.versions[user]
+            snapshot = self._snapshot(user) if user >= 0 else None
+        recommendations = self._compute(user, snapshot) if snapshot is not None else []
+        with self.lock:
+            # A change to the user's two-hop neighbourhood while counting makes the result stale
+            if self.versions[user] == version:
+                self.cache.put(user, recommendations)
+        return recommendations[:k], False
+
+    def _has_friend(self, owner, friend):
+        return bool((self.friends_of(owner) == friend).any())
+
+    def _set_listed(self, owner, friend, present):
+        """Add or remove friend from owner's list in the overlay; return whether it changed."""
+        if self._has_friend(owner, friend) == present:
+            return False
+        undo, do = (self.removed, self.added) if present else (self.added, self.removed)
+        undo_in, do_in = (self.removed_in, self.added_in) if present else (self.added_in, self.removed_in)
+        if friend in undo.get(owner, ()):
+            # Reverting an earlier change brings the loaded row back
+            undo[owner].discard(friend)
+            undo_in[friend].discard(owner)
+            for overlay, key in ((undo, owner), (undo_in, friend)):
+                if not overlay[key]:
+                    del overlay[key]
+        else:
+            do[owner].add(friend)
+            do_in[friend].add(owner)
+        return True
+
+    def apply_changes(self, changes):
+        """
+        Apply ('+' or '-', u, v) friendship changes in order and evict the
+        cached results they affect. Returns the number of evicted results.
+        """
+        evicted = 0
+        with self.lock:
+            for op, u, v in changes:
+                if op not in ('+', '-'):
+                    raise ValueError(f"Unknown change operation: {op}")
+                if u == v or u < 0 or v < 0:
+                    continue
+                changed = False
+                for owner, friend in ((u, v), (v, u)):
+                    changed |= self._set_listed(owner, friend, op == '+')
+                if not changed:
+                    continue
+                affected = {u, v}
+                affected.update(self.friends_of(u).tolist())
+                affected.update(self.friends_of(v).tolist())
+                for user in affected:
+                    self.versions[user] += 1
+                evicted += sum(self.cache.discard(user) for user in affected)
+            self.invalidations += evicted
+        return evicted
+
+    def stats(self):
+        with self.lock:
+            return {
+                'users': self.n_nodes,
+                'friend_list_entries': len(self.indices),
+                'overlay_lists': len(self.added.keys() | self.removed.keys()),
+                'cache_entries': len(self.cache),
+                'cache_capacity': self.cache.max_entries,
+                'cache_hits': self.cache.hits,
+                'cache_misses': self.cache.misses,
+                'invalidations': self.invalidations,
+            }
+
+def parse_changes(text):
+    """Parse '+ u v' / '- u v' lines, the delta format of incremental.py."""
+    changes = []
+    for line in text.splitlines():
+        parts = line.split()
+        if not parts:
+            continue
+        if len(parts) != 3:
+            raise ValueError(f"Malformed change line: {line!r}")
+        changes.append((parts[0], int(parts[1]), int(parts[2])))
+    return changes
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """
+    GET  /recommendations/<user>?k=N  top-k recommendations with mutual friend counts
+    POST /friendships                 apply '+ u v' / '- u v' lines
+    GET  /stats                       graph and cache counters
+    """
+    service = None
+    quiet = False
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+        try:
+            if parts == ['stats']:
+                self._send_json(200, self.service.stats())
+            elif len(parts) == 2 and parts[0] == 'recommendations':
+                start = time.perf_counter()
+                user = int(parts[1])
+                k = int(parse_qs(url.query).get('k', [self.service.max_k])[0])
+                recommendations, cached = self.service.recommend(user, k)
+                self._send_json(200, {
+                    'user': user,
+                    'recommendations': [[rec, count] for rec, count in recommendations],
+                    'cached': cached,
+                    'milliseconds': round((time.perf_counter() - start) * 1000, 3),
+                })
+            else:
+                self._send_json(404, {'error': f"Unknown path: {url.path}"})
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+
+    def do_POST(self):
+        if urlparse(self.path).path.strip('/') != 'friendships':
+            self._send_json(404, {'error': f"Unknown path: {self.path}"})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            changes = parse_changes(self.rfile.read(length).decode())
+            evicted = self.service.apply_changes(changes)
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        self._send_json(200, {'changes': len(changes), 'evicted': evicted})
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        UnixStreamServer.server_bind(self)
+        # Attributes BaseHTTPRequestHandler expects from HTTPServer
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Recommendation query service')
+    parser.add_argument('--input', default='soc-LiveJournal1Adj.txt', help='Adjacency list input file')
+    parser.add_argument('--graph-store', action='store_true',
+                        help='Load the cached binary CSR copy of the input instead of parsing it')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on')
+    parser.add_argument('--socket', help='Listen on this Unix socket instead of TCP')
+    parser.add_argument('--top-k', type=int, default=10, help='Largest k a query may ask for')
+    parser.add_argument('--cache-size', type=int, default=100000, help='Users whose results are cached')
+    parser.add_argument('--quiet', action='store_true', help='Do not log every request')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    start = time.perf_counter()
+    indptr, indices = load_graph_store(args.input) if args.graph_store else load_adjacency(args.input)
+    QueryHandler.service = RecommendationService(indptr, indices, args.top_k, args.cache_size)
+    QueryHandler.quiet = args.quiet
+    print(f"Loaded {len(indptr) - 1} users in {time.perf_counter() - start:.2f}s")
+
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = ThreadingUnixHTTPServer(args.socket, QueryHandler)
+        print(f"Listening on {args.socket}")
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), QueryHandler)
+        print(f"Listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
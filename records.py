@@ -0,0 +1,197 @@
+# records.py
+"""
+Intermediate record formats shared by the mapper, the data processor and the reducer.
+
+Every intermediate record is a (user_a, user_b, value) triple with user_a <= user_b.
+
+text:   'user_a\\tuser_b\\tvalue\\n' lines. IDs are strings, value is 'direct',
+        a mutual friend ID or a '#n' count from a combining mapper. Handy for debugging.
+binary: packed little-endian int32 triples (12 bytes per record). IDs are ints,
+        value is DIRECT (-1) or a mutual friend count.
+
+In approximate runs (mapper --sample-degree) every mutual friend is a count
+record holding its weight in 1/WEIGHT_SCALE units; the reducer rescales them.
+
+Files moved between the orchestrator and workers can additionally be
+compressed with one of CODECS; see wrap_stream.
+"""
+import bz2
+import gzip
+import lzma
+import sys
+from array import array
+
+FORMATS = ('text', 'binary')
+PARTITION_MODES = ('pair', 'user')
+CODECS = ('none', 'gzip', 'bz2', 'lzma')
+
+# Compression level used when none is given; gzip's own default of 9 is slow
+DEFAULT_LEVELS = {'gzip': 6, 'bz2': 9, 'lzma': 6}
+
+DIRECT = -1
+COUNT_PREFIX = '#'
+
+# Fixed-point unit of the pair weights emitted by sampling mappers
+WEIGHT_SCALE = 100
+# Largest weight a record can hold (binary values are int32)
+MAX_WEIGHT = 2 ** 31 - 1
+# Smallest sample degree accepted. Weights grow with the square of a hub's degree,
+# so mappers still reject hubs whose weight exceeds MAX_WEIGHT (see mapper.pair_weight)
+MIN_SAMPLE_DEGREE = 10
+
+RECORD_SIZE = 12
+READ_CHUNK_RECORDS = 65536
+
+def id_type(fmt):
+    """Python type used for user IDs in the given format."""
+    return int if fmt == 'binary' else str
+
+def pair_key(a, b):
+    """Order a pair of users the way every record stores it."""
+    return (a, b) if a <= b else (b, a)
+
+def wrap_stream(stream, mode, codec='none', level=None):
+    """
+    Wrap a binary stream so that reads ('rb') decompress or writes ('wb')
+    compress with codec. 'none' returns the stream itself. Closing the
+    wrapper flushes it but leaves the underlying stream open.
+    """
+    if codec == 'none':
+        return stream
+    if codec not in CODECS:
+        raise ValueError(f"Unknown codec: {codec}")
+    if level is None:
+        level = DEFAULT_LEVELS[codec]
+    if codec == 'gzip':
+        return gzip.GzipFile(fileobj=stream, mode=mode, compresslevel=level)
+    if codec == 'bz2':
+        return bz2.BZ2File(stream, mode, compresslevel=level)
+    return lzma.LZMAFile(stream, mode, preset=level if 'w' in mode else None)
+
+def partition_of(key, n_partitions):
+    """
+    Stable partition of an integer key (Knuth multiplicative hash).
+    Unlike hash() on strings it is the same in every process, so workers
+    and the orchestrator agree on it.
+    """
+    return (((int(key) * 2654435761) & 0xFFFFFFFF) >> 8) % n_partitions
+
+def pair_partition(a, b, n_partitions):
+    """Partition of a pair record when records are routed by pair."""
+    return partition_of(int(a) * 1000003 + int(b), n_partitions)
+
+class RecordWriter:
+    """Buffered writer of intermediate records to a binary stream."""
+
+    def __init__(self, stream, fmt='text', buffer_records=65536):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown record format: {fmt}")
+        self.stream = stream
+        self.fmt = fmt
+        self.buffer_records = buffer_records
+        self.records_written = 0
+        self._pending = 0
+        self._buffer = array('i') if fmt == 'binary' else []
+
+    def write(self, a, b, value):
+        """Write a record whose value is already in this format's representation."""
+        if self.fmt == 'binary':
+            self._buffer.extend((a, b, value))
+        else:
+            self._buffer.append(f"{a}\t{b}\t{value}\n")
+        self._pending += 1
+        if self._pending >= self.buffer_records:
+            self.flush()
+
+    def write_direct(self, a, b):
+        self.write(a, b, DIRECT if self.fmt == 'binary' else 'direct')
+
+    def write_mutual(self, a, b, mutual_friend):
+        self.write(a, b, 1 if self.fmt == 'binary' else mutual_friend)
+
+    def write_count(self, a, b, count):
+        self.write(a, b, count if self.fmt == 'binary' else f"{COUNT_PREFIX}{count}")
+
+    def write_records(self, records):
+        for a, b, value in records:
+            self.write(a, b, value)
+
+    def write_array(self, records):
+        """Write an (n, 3) NumPy integer array of binary records with one write."""
+        if self.fmt != 'binary':
+            raise ValueError("Array writes need the binary record format")
+        self.flush()
+        self.stream.write(records.astype('<i4', copy=False).tobytes())
+        self.records_written += len(records)
+
+    def flush(self):
+        if not self._pending:
+            return
+        if self.fmt == 'binary':
+            if sys.byteorder == 'big':
+                self._buffer.byteswap()
+            self.stream.write(self._buffer.tobytes())
+            self._buffer = array('i')
+        else:
+            self.stream.write(''.join(self._buffer).encode())
+            self._buffer = []
+        self.records_written += self._pending
+        self._pending = 0
+
+    def close(self):
+        self.flush()
+        self.stream.flush()
+
+def parse_text_record(line):
+    """Parse a text record line, returning None for malformed lines."""
+    if isinstance(line, bytes):
+        line = line.decode()
+    parts = line.rstrip('\n').split('\t')
+    if len(parts) < 3:
+        return None
+    return parts[0], parts[1], parts[2]
+
+def read_records(stream, fmt='text'):
+    """Yield (user_a, user_b, value) records from a binary or text stream."""
+    if fmt == 'binary':
+        yield from _read_binary_records(stream)
+        return
+    for line in stream:
+        record = parse_text_record(line)
+        if record is not None:
+            yield record
+
+def _read_binary_records(stream):
+    chunk_size = RECORD_SIZE * READ_CHUNK_RECORDS
+    leftover = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        data = leftover + chunk
+        usable = len(data) - len(data) % RECORD_SIZE
+        leftover = data[usable:]
+        values = array('i')
+        values.frombytes(data[:usable])
+        if sys.byteorder == 'big':
+            values.byteswap()
+        it = iter(values)
+        yield from zip(it, it, it)
+
+def write_query_file(path, targets, scope):
+    """
+    Write the broadcast file for a targeted query: the target users on the
+    first line, the targets plus everyone adjacent to them on the second.
+    """
+    with open(path, 'w') as f:
+        f.write(','.join(str(user) for user in sorted(targets, key=int)) + '\n')
+        f.write(','.join(str(user) for user in sorted(scope, key=int)) + '\n')
+
+def read_query_file(path, fmt='text'):
+    """Read a query file written by write_query_file into (targets, scope) sets."""
+    to_id = id_type(fmt)
+    with open(path, 'r') as f:
+        lines = f.read().split('\n')
+    targets = {to_id(user) for user in lines[0].split(',') if user}
+    scope = {to_id(user) for user in lines[1].split(',') if user} if len(lines) > 1 else set()
+    return targets, scope | targets
@@ -1,69 +1,308 @@
 # reducer.py
+import argparse
+import heapq
+import io
+import math
+import os
 import sys
+import time
 from collections import defaultdict
 
-def parse_mapper_output(line):
-    """Parse a line from mapper output into key and value."""
-    parts = line.strip().split('\t')
-    if len(parts) < 2:
-        return None, None
-    key = tuple(parts[:2])
-    value = parts[2] if len(parts) > 2 else None
-    return key, value
+from records import (CODECS, COUNT_PREFIX, DIRECT, FORMATS, WEIGHT_SCALE, partition_of, read_query_file,
+                     read_records, wrap_stream)
 
-def reduce_recommendations():
+def count_mutual_friends(values, fmt='text'):
     """
-    Reducer function that processes mapper output and generates recommendations.
-    For each pair of users, it:
-    1. Checks if they are direct friends.
-    2. Counts the number of mutual friends if they are not direct friends.
+    Count mutual friends for a pair, or return None if the pair are direct friends.
+    Text values are mutual friend IDs or '#n' counts from a combining mapper;
+    binary values are already counts.
+    """
+    if fmt == 'binary':
+        if DIRECT in values:
+            return None
+        return sum(values)
+
+    if 'direct' in values:
+        return None
+    mutual_friends = set()
+    combined_count = 0
+    for value in values:
+        if value.startswith(COUNT_PREFIX):
+            combined_count += int(value[1:])
+        else:
+            mutual_friends.add(value)
+    return combined_count + len(mutual_friends)
+
+def estimate_mutual_friends(values, fmt='text'):
+    """
+    Rescale the weighted counts of an approximate run into (estimated mutual
+    friends, variance of the estimate), or return None for direct friends.
+    Each value is one mutual friend weighted by 1/p in WEIGHT_SCALE units, p
+    being the chance its pair was sampled, so the sum is an unbiased
+    (Horvitz-Thompson) estimate and each contributes w(w - 1) to the variance.
+    """
+    if fmt == 'binary':
+        if DIRECT in values:
+            return None
+        weights = [weight / WEIGHT_SCALE for weight in values]
+    else:
+        if 'direct' in values:
+            return None
+        weights = [int(value[len(COUNT_PREFIX):]) / WEIGHT_SCALE for value in values]
+    return round(sum(weights)), sum(weight * (weight - 1) for weight in weights)
+
+def keeps_user(user, targets=None, partition=None):
+    """
+    Whether this reducer emits recommendations for user: it must be a target
+    (when targets are set) and owned by this reducer's (index, n_partitions).
+    """
+    if targets is not None and user not in targets:
+        return False
+    return partition is None or partition_of(user, partition[1]) == partition[0]
+
+def push_top_k(heap, k, candidate, count):
+    """
+    Offer a candidate to a bounded min-heap holding a user's best k.
+    The heap root is the current worst entry: lowest count, then highest ID.
+    """
+    item = (count, -int(candidate), candidate)
+    if len(heap) < k:
+        heapq.heappush(heap, item)
+    elif item > heap[0]:
+        heapq.heapreplace(heap, item)
+
+def rank_recommendations(recommendations, k):
+    """Sort (candidate, count) items by count descending, then ID ascending, and keep k."""
+    return sorted(recommendations, key=lambda x: (-x[1], int(x[0])))[:k]
+
+def format_recommendations(user, ranked):
+    return f"{user}\t{','.join(f'{rec}:{count}' for rec, count in ranked)}"
+
+def iter_pair_counts(records, fmt='text', stats=None, approximate=False):
+    """
+    Group sorted mapper output records by pair and yield (user_a, user_b, count)
+    for every pair that are not direct friends.
+    Records and pairs read are counted into stats if given. With approximate,
+    counts are rescaled estimates, and their sum and the sum of their standard
+    errors are added up in stats.
     """
     current_pair = None
     values = []
+    if stats is None:
+        stats = {}
+    stats.setdefault('records_read', 0)
+    stats.setdefault('pairs', 0)
+    if approximate:
+        stats.setdefault('estimated_count', 0)
+        stats.setdefault('estimated_std_error', 0.0)
 
-    user_recommendations = defaultdict(lambda: defaultdict(int))
-
-    for line in sys.stdin:
-        # Parse input
-        key, value = parse_mapper_output(line)
-        if not key:
-            continue
+    def count_mutual_friends_of_pair(values):
+        if not approximate:
+            return count_mutual_friends(values, fmt)
+        estimate = estimate_mutual_friends(values, fmt)
+        if estimate is None:
+            return None
+        count, variance = estimate
+        stats['estimated_count'] += count
+        stats['estimated_std_error'] += math.sqrt(variance)
+        return count
 
+    for user_a, user_b, value in records:
+        stats['records_read'] += 1
+        key = (user_a, user_b)
         if current_pair != key:
-            if current_pair and 'direct' not in values:
-                # Not direct friends, so accumulate mutual friends
-                user_a, user_b = current_pair
-                mutual_friends = set(values)
-                count = len(mutual_friends)
-
-                # Update recommendations for both users
-                user_recommendations[user_a][user_b] += count
-                user_recommendations[user_b][user_a] += count
+            if current_pair:
+                count = count_mutual_friends_of_pair(values)
+                if count is not None:
+                    yield current_pair + (count,)
 
             # Reset for new key
+            stats['pairs'] += 1
             current_pair = key
             values = []
 
         values.append(value)
 
     # Process last pair
-    if current_pair and 'direct' not in values:
-        user_a, user_b = current_pair
-        mutual_friends = set(values)
-        count = len(mutual_friends)
-        user_recommendations[user_a][user_b] += count
-        user_recommendations[user_b][user_a] += count
+    if current_pair:
+        count = count_mutual_friends_of_pair(values)
+        if count is not None:
+            yield current_pair + (count,)
+
+def reduce_recommendations(fmt='text', targets=None, top_k=10, stats=None, partition=None,
+                           records=None, output=None, approximate=False):
+    """
+    Reducer function that processes mapper output and generates recommendations.
+    For each pair of users, it:
+    1. Checks if they are direct friends.
+    2. Counts the number of mutual friends if they are not direct friends.
+    With targets, only recommendations for those users are kept; with a
+    partition, only those for users this reducer owns. With approximate,
+    counts are estimated from the weighted records of sampling mappers.
+    Reads records from stdin and prints to stdout unless others are given.
+    """
+    user_recommendations = defaultdict(lambda: defaultdict(int))
+
+    if records is None:
+        records = read_records(sys.stdin.buffer, fmt)
+    for user_a, user_b, count in iter_pair_counts(records, fmt, stats, approximate):
+        # Not direct friends, update recommendations for both users
+        if keeps_user(user_a, targets, partition):
+            user_recommendations[user_a][user_b] += count
+        if keeps_user(user_b, targets, partition):
+            user_recommendations[user_b][user_a] += count
 
     # Output recommendations with counts
     for user in user_recommendations:
-        recommendations = user_recommendations[user]
         # Sort recommendations first by count descending, then by user ID ascending
-        sorted_recommendations = sorted(
-            recommendations.items(),
-            key=lambda x: (-x[1], int(x[0]))
-        )
-        top_recommendations = [f"{rec[0]}:{rec[1]}" for rec in sorted_recommendations[:10]]
-        print(f"{user}\t{','.join(top_recommendations)}")
+        ranked = rank_recommendations(user_recommendations[user].items(), top_k)
+        print(format_recommendations(user, ranked), file=output)
+    if stats is not None:
+        stats['users_emitted'] = len(user_recommendations)
+
+def reduce_recommendations_streaming(fmt='text', targets=None, top_k=10, stats=None, partition=None,
+                                     records=None, output=None, approximate=False):
+    """
+    Reducer that keeps only a bounded heap of the best top_k candidates per user.
+    Input is sorted by pair, so each pair's mutual friend count is final when
+    its group ends and can be offered to both users' heaps straight away.
+    Memory grows with users x top_k instead of with the number of candidate pairs.
+    """
+    heaps = defaultdict(list)
+
+    if records is None:
+        records = read_records(sys.stdin.buffer, fmt)
+    for user_a, user_b, count in iter_pair_counts(records, fmt, stats, approximate):
+        if keeps_user(user_a, targets, partition):
+            push_top_k(heaps[user_a], top_k, user_b, count)
+        if keeps_user(user_b, targets, partition):
+            push_top_k(heaps[user_b], top_k, user_a, count)
+
+    for user, heap in heaps.items():
+        ranked = [(rec, count) for count, _, rec in sorted(heap, reverse=True)]
+        print(format_recommendations(user, ranked), file=output)
+    if stats is not None:
+        stats['users_emitted'] = len(heaps)
+
+def run_reducer(args, targets, stats, partition, records, output=None):
+    """Run the reducer variant chosen on the command line."""
+    reduce = reduce_recommendations_streaming if args.streaming else reduce_recommendations
+    reduce(args.format, targets, args.top_k, stats, partition, records, output, args.approximate)
+
+def reduce_part(job):
+    """Reduce one range of pairs in a worker process, writing its users' lists to the part file."""
+    from intra_node import open_range
+    args, partition, input_path, (start, end), part_path = job
+    stats = {}
+    targets = read_query_file(args.targets, args.format)[0] if args.targets else None
+    with open_range(input_path, start, end) as stream, open(part_path, 'w') as output:
+        run_reducer(args, targets, stats, partition, read_records(stream, args.format), output)
+    return stats
+
+def merge_part_outputs(part_paths, top_k, output=None):
+    """
+    Combine the worker processes' output into one list per user. Workers
+    saw disjoint pairs, so a user's best top_k is among the union of their lists.
+    """
+    merged = defaultdict(list)
+    for path in part_paths:
+        with open(path, 'r') as f:
+            for line in f:
+                user, _, recommendations = line.rstrip('\n').partition('\t')
+                for rec in recommendations.split(','):
+                    if rec:
+                        candidate, count = rec.split(':')
+                        merged[user].append((candidate, int(count)))
+    for user, recommendations in merged.items():
+        print(format_recommendations(user, rank_recommendations(recommendations, top_k)), file=output)
+    return len(merged)
+
+def reduce_in_parallel(args, stats, partition, fetched_files, output=None):
+    """
+    Divide this reducer's sorted input among args.workers processes by pair
+    and merge their per-user lists on the node. The input is first written
+    out as one uncompressed sorted file so it can be divided.
+    """
+    import shutil
+    import tempfile
+    from intra_node import add_stats, group_ranges, run_parts, spool
+
+    work_dir = tempfile.mkdtemp(prefix='reducer_parts_', dir='.')
+    try:
+        input_path = os.path.join(work_dir, 'input')
+        if fetched_files:
+            from shuffle import merge_sorted, write_run
+            write_run(merge_sorted(fetched_files, args.format, args.codec), input_path, args.format)
+        else:
+            spool(wrap_stream(sys.stdin.buffer, 'rb', args.codec), input_path)
+        ranges = group_ranges(input_path, args.format, args.workers)
+        jobs = [(args, partition, input_path, pairs, os.path.join(work_dir, f'part_{k}'))
+                for k, pairs in enumerate(ranges)]
+        for part_stats in run_parts(reduce_part, jobs, args.workers):
+            add_stats(stats, part_stats)
+        stats['users_emitted'] = merge_part_outputs([job[-1] for job in jobs], args.top_k, output)
+        stats['workers'] = args.workers
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Friend recommendation reducer')
+    parser.add_argument('--format', choices=FORMATS, default='text',
+                        help='Intermediate record format')
+    parser.add_argument('--targets', help='Query file: only keep recommendations for its target users')
+    parser.add_argument('--top-k', type=int, default=10, help='Recommendations kept per user')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Keep a bounded top-k heap per user instead of every candidate pair')
+    parser.add_argument('--approximate', action='store_true',
+                        help='Rescale the weighted counts of mappers run with --sample-degree')
+    parser.add_argument('--partition', type=int,
+                        help='Only emit users owned by this reducer under user-keyed partitioning')
+    parser.add_argument('--n-partitions', type=int, help='Number of reducers, used with --partition')
+    parser.add_argument('--codec', choices=CODECS, default='none',
+                        help='Compression of the input partition and of the output')
+    parser.add_argument('--compression-level', type=int, help='Compression level for the output')
+    parser.add_argument('--shuffle-store', help='Fetch this reducer\'s partition from every mapper in this store')
+    parser.add_argument('--reducer-index', type=int, default=0, help='Index of this reducer, used with --shuffle-store')
+    parser.add_argument('--n-mappers', type=int, default=1, help='Number of mappers, used with --shuffle-store')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Processes that share this reducer\'s pairs (default: one per core)')
+    parser.add_argument('--stats', help='Write timing and record counts to this JSON file')
+    args = parser.parse_args()
+    if args.workers is None:
+        from intra_node import default_workers
+        args.workers = default_workers()
+    return args
 
 if __name__ == "__main__":
-    reduce_recommendations()
\ No newline at end of file
+    args = parse_args()
+    start = time.perf_counter()
+    stats = {}
+    partition = (args.partition, args.n_partitions) if args.partition is not None else None
+    fetched_files = []
+    if args.shuffle_store:
+        from shuffle import merge_sorted, open_store, partition_key
+        store = open_store(args.shuffle_store)
+        for j in range(args.n_mappers):
+            path = f'reducer_input_{args.reducer_index}_map_{j}'
+            store.get(partition_key(j, args.reducer_index), path)
+            fetched_files.append(path)
+        stats['bytes_fetched'] = sum(os.path.getsize(path) for path in fetched_files)
+    output = None
+    if args.codec != 'none':
+        output = io.TextIOWrapper(wrap_stream(sys.stdout.buffer, 'wb', args.codec, args.compression_level))
+    if args.workers > 1:
+        reduce_in_parallel(args, stats, partition, fetched_files, output)
+    else:
+        targets = read_query_file(args.targets, args.format)[0] if args.targets else None
+        if fetched_files:
+            records = merge_sorted(fetched_files, args.format, args.codec)
+        else:
+            records = read_records(wrap_stream(sys.stdin.buffer, 'rb', args.codec), args.format)
+        run_reducer(args, targets, stats, partition, records, output)
+    if output is not None:
+        output.close()
+    for path in fetched_files:
+        os.remove(path)
+    if args.stats:
+        from run_report import write_worker_stats
+        write_worker_stats(args.stats, 'reducer', time.perf_counter() - start, stats)
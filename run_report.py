@@ -0,0 +1,91 @@
+import json
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def peak_rss_bytes():
+    """Peak resident set size of this process, or None where it cannot be measured."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+class RunReport:
+    """Collects per-phase timings, transfer sizes, record counts and worker stats for one job."""
+
+    def __init__(self, config=None):
+        self.config = config or {}
+        self.started_at = time.time()
+        self.status = 'running'
+        self.error = None
+        self.phases = {}
+
+    def _phase(self, name):
+        return self.phases.setdefault(name, {'seconds': 0.0, 'instances': {}})
+
+    @contextmanager
+    def phase(self, name):
+        """Time a phase and record the orchestrator's peak RSS at its end."""
+        start = time.perf_counter()
+        try:
+            yield self._phase(name)
+        finally:
+            phase = self._phase(name)
+            phase['seconds'] = round(phase['seconds'] + time.perf_counter() - start, 4)
+            phase['peak_rss_bytes'] = peak_rss_bytes()
+
+    def instance(self, phase_name, instance_id):
+        """Per-instance entry of a phase."""
+        return self._phase(phase_name)['instances'].setdefault(instance_id, {})
+
+    def add_instance_seconds(self, phase_name, instance_id, seconds):
+        entry = self.instance(phase_name, instance_id)
+        entry['seconds'] = round(entry.get('seconds', 0.0) + seconds, 4)
+
+    def add_bytes(self, phase_name, instance_id, n_bytes):
+        entry = self.instance(phase_name, instance_id)
+        entry['bytes'] = entry.get('bytes', 0) + n_bytes
+
+    def add_bytes_by_instance(self, phase_name, bytes_by_instance):
+        for instance_id, n_bytes in bytes_by_instance.items():
+            self.add_bytes(phase_name, instance_id, n_bytes)
+
+    def set_counts(self, phase_name, **counts):
+        """Record phase-wide counters such as records_emitted or records_consumed."""
+        self._phase(phase_name).update(counts)
+
+    def add_worker_stats(self, phase_name, instance_id, stats, task=None):
+        """Attach the stats a mapper or reducer reported about itself, by task when given."""
+        entry = self.instance(phase_name, instance_id)
+        if task is None:
+            entry['worker'] = stats
+        else:
+            entry.setdefault('tasks', {})[str(task)] = stats
+
+    def to_dict(self):
+        return {
+            'status': self.status,
+            'error': self.error,
+            'started_at': self.started_at,
+            'total_seconds': round(time.time() - self.started_at, 4),
+            'peak_rss_bytes': peak_rss_bytes(),
+            'config': self.config,
+            'phases': self.phases,
+        }
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+def write_worker_stats(path, role, seconds, stats):
+    """Sidecar file a mapper or reducer writes about its own run."""
+    report = {'role': role, 'seconds': round(seconds, 4), 'peak_rss_bytes': peak_rss_bytes()}
+    report.update(stats)
+    with open(path, 'w') as f:
+        json.dump(report, f)
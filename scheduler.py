@@ -0,0 +1,145 @@
+# scheduler.py
+"""
+Dynamic task scheduling for the orchestrator's map and reduce phases.
+
+A phase is cut into tasks that are handed out from a queue to whichever
+worker is free, so fast workers take on more tasks and a slow one holds up
+only the task it is running. A failed attempt puts its task back on the
+queue for another worker, and a worker that fails several attempts in a row
+is no longer given work. With speculation on, once the queue is empty an
+idle worker starts a backup copy of a task that has been running much longer
+than finished tasks took; whichever copy finishes first wins and the other
+is abandoned.
+
+Attempts of the same task must be safe to run side by side on different
+workers: task outputs are named by task and written on the worker running
+it, and the winner's worker is the one whose files are read afterwards.
+"""
+import statistics
+import threading
+import time
+from collections import deque
+
+class TaskScheduler:
+    """
+    Run tasks on workers. preferred(task) names the worker that already
+    holds a task's input; an idle worker takes its own tasks first, then
+    any other queued task.
+    """
+
+    def __init__(self, workers, max_attempts=3, speculative=False, slow_task_factor=1.5,
+                 max_worker_failures=3, preferred=None):
+        self.workers = list(workers)
+        self.max_attempts = max_attempts
+        self.speculative = speculative
+        # A running task gets a backup copy once it has taken this many times the median task time
+        self.slow_task_factor = slow_task_factor
+        self.max_worker_failures = max_worker_failures
+        self.preferred = preferred
+        self.stats = {}
+
+    def run(self, tasks, run_task):
+        """
+        Call run_task(task, worker) until every task has succeeded once or
+        used up its attempts. Returns (placement, errors): the worker and
+        result of each successful task, and the last error of each failed one.
+        """
+        tasks = list(tasks)
+        condition = threading.Condition()
+        queue = deque(tasks)
+        running = {}  # task -> {worker index: start time}
+        attempts = {task: 0 for task in tasks}
+        failed_on = {task: set() for task in tasks}
+        placement, errors = {}, {}
+        durations = []
+        idle = list(range(len(self.workers)))
+        consecutive_failures = [0] * len(self.workers)
+        counters = {'tasks': len(tasks), 'attempts': 0, 'retries': 0, 'speculative_attempts': 0,
+                    'speculative_wins': 0, 'excluded_workers': []}
+
+        def usable(w):
+            return consecutive_failures[w] < self.max_worker_failures
+
+        def settled(task):
+            return task in placement or task in errors
+
+        def attempt(task, w, speculative):
+            start = time.perf_counter()
+            try:
+                result, error = run_task(task, self.workers[w]), None
+            except Exception as e:
+                result, error = None, e
+            with condition:
+                running[task].pop(w, None)
+                if error is None:
+                    consecutive_failures[w] = 0
+                    if not settled(task):
+                        placement[task] = (self.workers[w], result)
+                        durations.append(time.perf_counter() - start)
+                        counters['speculative_wins'] += speculative
+                else:
+                    consecutive_failures[w] += 1
+                    failed_on[task].add(w)
+                    print(f"Task {task} failed on {self.workers[w].id}: {error}")
+                    if not settled(task) and not running[task]:
+                        if attempts[task] < self.max_attempts and any(usable(v) for v in range(len(self.workers))):
+                            # Retry ahead of tasks that have not started yet
+                            queue.appendleft(task)
+                            counters['retries'] += 1
+                        else:
+                            errors[task] = error
+                if usable(w):
+                    idle.append(w)
+                condition.notify_all()
+
+        def next_task(w):
+            """Pick a queued task for worker w, or a straggler to back up; None if there is nothing."""
+            # A task only goes back to a worker it failed on once every usable worker has failed it
+            usable_workers = {v for v in range(len(self.workers)) if usable(v)}
+            candidates = [task for task in queue if w not in failed_on[task] or usable_workers <= failed_on[task]]
+            if candidates:
+                own = [task for task in candidates
+                       if self.preferred is not None and self.preferred(task) is self.workers[w]]
+                task = (own or candidates)[0]
+                queue.remove(task)
+                return task, False
+            if not self.speculative or not durations:
+                return None
+            threshold = self.slow_task_factor * statistics.median(durations)
+            now = time.perf_counter()
+            stragglers = [(min(starts.values()), task) for task, starts in running.items()
+                          if len(starts) == 1 and w not in starts and not settled(task)
+                          and attempts[task] < self.max_attempts
+                          and now - min(starts.values()) > threshold]
+            if not stragglers:
+                return None
+            return min(stragglers)[1], True
+
+        with condition:
+            while not all(settled(task) for task in tasks):
+                progressed = False
+                for w in list(idle):
+                    picked = next_task(w)
+                    if picked is None:
+                        continue
+                    task, speculative = picked
+                    idle.remove(w)
+                    attempts[task] += 1
+                    counters['attempts'] += 1
+                    counters['speculative_attempts'] += speculative
+                    running.setdefault(task, {})[w] = time.perf_counter()
+                    # Daemon threads: an abandoned copy must not keep the job alive
+                    threading.Thread(target=attempt, args=(task, w, speculative), daemon=True).start()
+                    progressed = True
+                if not progressed and not any(running.values()):
+                    # Nothing is running and no worker can take the queued tasks
+                    for task in tasks:
+                        if not settled(task):
+                            errors[task] = Exception("No usable worker left to run the task")
+                    break
+                # Wake up periodically to look for stragglers
+                condition.wait(timeout=1.0 if self.speculative else None)
+
+            counters['excluded_workers'] = [self.workers[w].id for w in range(len(self.workers)) if not usable(w)]
+            self.stats = counters
+            return placement, errors
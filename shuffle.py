@@ -0,0 +1,236 @@
+# shuffle.py
+"""
+Sort-based shuffle shared by the orchestrator and the workers.
+
+PartitionWriter routes intermediate records to reducer partitions and sorts
+each partition with an external sort. The data processor runs it on the
+orchestrator over every mapper's output. With a shuffle store, each mapper
+runs it on its own output and pushes the sorted partitions to the store,
+and each reducer fetches its partition from every mapper and merges them,
+so no intermediate data passes through the orchestrator.
+
+Stores are addressed by URL: 's3://bucket/prefix' for an S3 bucket, anything
+else is a directory every worker can reach (the host's disk for the local
+backend, or a shared mount). A job only ever removes the keys it wrote, so a
+store may share its directory or prefix with other data.
+"""
+import heapq
+import os
+import shutil
+import tempfile
+from contextlib import ExitStack
+
+from records import PARTITION_MODES, RecordWriter, pair_partition, partition_of, read_records, wrap_stream
+
+# Maximum number of spill runs merged at once
+MERGE_FAN_IN = 64
+
+# Most keys one S3 DeleteObjects request accepts
+S3_DELETE_BATCH = 1000
+
+def write_run(records, path, fmt='text', codec='none', compression_level=None):
+    """Write already sorted records to a file."""
+    with open(path, 'wb') as f:
+        with wrap_stream(f, 'wb', codec, compression_level) as stream:
+            writer = RecordWriter(stream, fmt)
+            writer.write_records(records)
+            writer.close()
+
+def merge_sorted(paths, fmt='text', codec='none'):
+    """Yield the records of several sorted files in sorted order."""
+    with ExitStack() as stack:
+        streams = [
+            read_records(stack.enter_context(wrap_stream(stack.enter_context(open(path, 'rb')), 'rb', codec)), fmt)
+            for path in paths
+        ]
+        yield from heapq.merge(*streams)
+
+class PartitionWriter(RecordWriter):
+    """
+    RecordWriter that divides records among len(output_paths) partitions.
+    'pair' routes each record by its pair; 'user' sends it to the partition
+    owning each of its two users. Records are buffered per partition until
+    memory_budget records are held, then every buffer is sorted and spilled
+    to a run file. close() writes each partition's sorted file, merging its
+    runs if it has any.
+    """
+
+    def __init__(self, output_paths, fmt='text', mode='pair', memory_budget=500000, temp_dir=None,
+                 codec='none', compression_level=None):
+        if mode not in PARTITION_MODES:
+            raise ValueError(f"Unknown partition mode: {mode}")
+        super().__init__(None, fmt)
+        self.output_paths = output_paths
+        self.mode = mode
+        self.memory_budget = memory_budget
+        # Only the partition files are compressed, spill runs stay on this machine
+        self.codec = codec
+        self.compression_level = compression_level
+        self.spill_dir = tempfile.mkdtemp(prefix='shuffle_', dir=temp_dir)
+        self.buffers = [[] for _ in output_paths]
+        self.runs = [[] for _ in output_paths]
+        self.buffered = 0
+        self.spilled_runs = 0
+
+    def write(self, a, b, value):
+        n_partitions = len(self.output_paths)
+        record = (a, b, value)
+        if self.mode == 'user':
+            first = partition_of(a, n_partitions)
+            second = partition_of(b, n_partitions)
+            self.buffers[first].append(record)
+            self.buffered += 1
+            if second != first:
+                self.buffers[second].append(record)
+                self.buffered += 1
+        else:
+            self.buffers[pair_partition(a, b, n_partitions)].append(record)
+            self.buffered += 1
+        self.records_written += 1
+        if self.buffered >= self.memory_budget:
+            for i in range(n_partitions):
+                self._spill_run(i)
+            self.spilled_runs = sum(len(run_files) for run_files in self.runs)
+            self.buffered = 0
+
+    def write_array(self, records):
+        """Route an array of records one at a time, since partitions sort Python tuples."""
+        for a, b, value in records.tolist():
+            self.write(a, b, value)
+
+    def flush(self):
+        """Records stay buffered until they are spilled or the writer is closed."""
+
+    def close(self):
+        """Write every partition's sorted file and remove the spill runs."""
+        try:
+            for i, path in enumerate(self.output_paths):
+                if self.runs[i]:
+                    self._spill_run(i)
+                    self._merge_runs(self.runs[i], path)
+                else:
+                    # Everything fit in memory, no merge needed
+                    self.buffers[i].sort()
+                    write_run(self.buffers[i], path, self.fmt, self.codec, self.compression_level)
+                self.buffers[i] = []
+        finally:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+    def _new_run_path(self):
+        fd, path = tempfile.mkstemp(suffix='.run', dir=self.spill_dir)
+        os.close(fd)
+        return path
+
+    def _spill_run(self, i):
+        """Sort a partition's buffer, write it out as a new run and empty it."""
+        buffer = self.buffers[i]
+        if not buffer:
+            return
+        buffer.sort()
+        path = self._new_run_path()
+        write_run(buffer, path, self.fmt)
+        buffer.clear()
+        self.runs[i].append(path)
+
+    def _merge_runs(self, runs, output_path):
+        """K-way merge sorted runs into output_path, at most MERGE_FAN_IN at a time."""
+        while len(runs) > MERGE_FAN_IN:
+            merged = []
+            for start in range(0, len(runs), MERGE_FAN_IN):
+                path = self._new_run_path()
+                self._merge_group(runs[start:start + MERGE_FAN_IN], path)
+                merged.append(path)
+            runs = merged
+        self._merge_group(runs, output_path, self.codec)
+
+    def _merge_group(self, runs, output_path, codec='none'):
+        write_run(merge_sorted(runs, self.fmt), output_path, self.fmt, codec, self.compression_level)
+        for run in runs:
+            os.remove(run)
+
+def partition_key(map_index, partition):
+    """Store key of the partition a mapper wrote for one reducer."""
+    return f'map_{map_index}/part_{partition}'
+
+class LocalStore:
+    """Shuffle store in a directory shared by every worker."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def put(self, local_path, key):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Copy then rename, so two attempts of the same map task never leave a torn file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        os.close(fd)
+        shutil.copy(local_path, tmp_path)
+        os.replace(tmp_path, path)
+
+    def get(self, key, local_path):
+        shutil.copy(os.path.join(self.root, key), local_path)
+
+    def exists(self, key):
+        return os.path.exists(os.path.join(self.root, key))
+
+    def remove(self, keys):
+        """Delete the given keys, and the directories under the root they leave empty."""
+        root = os.path.abspath(self.root)
+        for key in keys:
+            path = os.path.abspath(os.path.join(root, key))
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            parent = os.path.dirname(path)
+            while parent.startswith(root + os.sep):
+                try:
+                    os.rmdir(parent)
+                except OSError:
+                    break
+                parent = os.path.dirname(parent)
+
+class S3Store:
+    """
+    Shuffle store under a prefix of an S3 bucket.
+    Workers need credentials for the bucket, e.g. from an instance profile.
+    """
+
+    def __init__(self, bucket, prefix='shuffle'):
+        import boto3
+        self.s3_client = boto3.client('s3')
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+
+    def _key(self, key):
+        return f'{self.prefix}/{key}'
+
+    def put(self, local_path, key):
+        self.s3_client.upload_file(local_path, self.bucket, self._key(key))
+
+    def get(self, key, local_path):
+        self.s3_client.download_file(self.bucket, self._key(key), local_path)
+
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            self.s3_client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        return True
+
+    def remove(self, keys):
+        """Delete the given keys; missing ones are ignored."""
+        objects = [{'Key': self._key(key)} for key in keys]
+        for start in range(0, len(objects), S3_DELETE_BATCH):
+            self.s3_client.delete_objects(Bucket=self.bucket,
+                                          Delete={'Objects': objects[start:start + S3_DELETE_BATCH]})
+
+def open_store(url):
+    """Open the shuffle store a URL points at."""
+    if url.startswith('s3://'):
+        bucket, _, prefix = url[len('s3://'):].partition('/')
+        return S3Store(bucket, prefix or 'shuffle')
+    return LocalStore(url)
@@ -0,0 +1,91 @@
+# test_incremental.py
+"""
+IncrementalRecommender: applying a delta must give the same state as a
+rebuild from the changed graph, and its cost must not grow with the graph.
+"""
+import random
+import time
+
+import pytest
+
+from incremental import IncrementalRecommender
+
+def random_graph(n_users, degree, seed):
+    rng = random.Random(seed)
+    edges = set()
+    while len(edges) < n_users * degree // 2:
+        u, v = rng.sample(range(n_users), 2)
+        edges.add((min(u, v), max(u, v)))
+    return edges
+
+def write_graph(path, edges):
+    adjacency = {}
+    for u, v in edges:
+        adjacency.setdefault(u, []).append(v)
+    with open(path, 'w') as f:
+        for user, friends in sorted(adjacency.items()):
+            f.write(f"{user}\t{','.join(map(str, friends))}\n")
+
+def random_delta(edges, n_users, n_changes, seed):
+    rng = random.Random(seed)
+    edges = set(edges)
+    changes = []
+    for _ in range(n_changes):
+        if rng.random() < 0.5:
+            u, v = rng.choice(sorted(edges))
+            edges.discard((u, v))
+            changes.append(('-', v, u))
+        else:
+            u, v = sorted(rng.sample(range(n_users), 2))
+            edges.add((u, v))
+            changes.append(('+', u, v))
+    return changes, edges
+
+def all_recommendations(path):
+    with IncrementalRecommender(path) as recommender:
+        return {user: recommender.recommendations(user) for user in recommender.users_with_recommendations()}
+
+@pytest.mark.parametrize('tracked', [None, list(range(0, 200, 3))])
+def test_apply_matches_rebuild(tmp_path, tracked):
+    edges = random_graph(200, 8, seed=1)
+    write_graph(tmp_path / 'graph.txt', edges)
+    IncrementalRecommender.build(tmp_path / 'graph.txt', tmp_path / 'state.db', top_k=5, tracked=tracked)
+    before = all_recommendations(tmp_path / 'state.db')
+
+    changes, new_edges = random_delta(edges, 200, 60, seed=2)
+    with IncrementalRecommender(tmp_path / 'state.db') as recommender:
+        changed = recommender.apply_delta(changes)
+        recommender.commit()
+    after = all_recommendations(tmp_path / 'state.db')
+
+    write_graph(tmp_path / 'new_graph.txt', new_edges)
+    IncrementalRecommender.build(tmp_path / 'new_graph.txt', tmp_path / 'rebuilt.db', top_k=5, tracked=tracked)
+    assert after == all_recommendations(tmp_path / 'rebuilt.db')
+    assert set(changed) == {user for user in set(before) | set(after) if before.get(user) != after.get(user)}
+
+def test_failed_apply_keeps_previous_state(tmp_path):
+    edges = random_graph(50, 6, seed=3)
+    write_graph(tmp_path / 'graph.txt', edges)
+    IncrementalRecommender.build(tmp_path / 'graph.txt', tmp_path / 'state.db')
+    before = all_recommendations(tmp_path / 'state.db')
+
+    u, v = next(iter(edges))
+    with pytest.raises(ValueError), IncrementalRecommender(tmp_path / 'state.db') as recommender:
+        recommender.apply_delta([('-', u, v), ('?', u, v)])
+    assert all_recommendations(tmp_path / 'state.db') == before
+
+def test_apply_time_stays_flat_as_graph_grows(tmp_path):
+    seconds = []
+    for n_users in (1000, 16000):
+        edges = random_graph(n_users, 10, seed=4)
+        write_graph(tmp_path / 'graph.txt', edges)
+        state = tmp_path / f'state_{n_users}.db'
+        IncrementalRecommender.build(tmp_path / 'graph.txt', state)
+        changes, _ = random_delta(edges, n_users, 20, seed=5)
+        start = time.perf_counter()
+        with IncrementalRecommender(state) as recommender:
+            recommender.apply_delta(changes)
+            recommender.commit()
+        seconds.append(time.perf_counter() - start)
+    # 16x the users with the same degrees: a full-state rewrite would take about 16x as long
+    assert seconds[1] < 3 * seconds[0] + 0.05, seconds
@@ -0,0 +1,97 @@
+# test_scheduler.py
+"""
+TaskScheduler driven by fake workers: run_task stands in for a remote
+mapper or reducer and fails or stalls on chosen workers.
+"""
+import threading
+import time
+
+import pytest
+
+from scheduler import TaskScheduler
+
+class FakeWorker:
+    def __init__(self, id):
+        self.id = id
+
+    def __repr__(self):
+        return self.id
+
+@pytest.fixture
+def workers():
+    return [FakeWorker('a'), FakeWorker('b')]
+
+def test_failed_task_is_retried_on_another_worker(workers):
+    a, b = workers
+    calls = []
+
+    def run_task(task, worker):
+        calls.append((task, worker))
+        if worker is a:
+            raise RuntimeError('disk full')
+        return f'{task}@{worker.id}'
+
+    placement, errors = TaskScheduler(workers).run(['t0'], run_task)
+
+    assert errors == {}
+    assert placement == {'t0': (b, 't0@b')}
+    assert calls == [('t0', a), ('t0', b)]
+
+def test_worker_is_excluded_after_repeated_failures(workers):
+    a, b = workers
+    tasks = [f't{i}' for i in range(6)]
+    calls_on_a = []
+
+    def run_task(task, worker):
+        if worker is a:
+            calls_on_a.append(task)
+            raise RuntimeError('connection reset')
+        return task
+
+    scheduler = TaskScheduler(workers, max_worker_failures=2)
+    placement, errors = scheduler.run(tasks, run_task)
+
+    assert errors == {}
+    assert set(placement) == set(tasks)
+    assert all(worker is b for worker, _ in placement.values())
+    assert len(calls_on_a) == 2
+    assert scheduler.stats['excluded_workers'] == ['a']
+
+def test_speculative_copy_wins_and_straggler_output_is_discarded(workers):
+    a, b = workers
+    release, straggler_done = threading.Event(), threading.Event()
+
+    def run_task(task, worker):
+        if task == 'slow' and worker is a:
+            # Holds until the test lets it go, well after the backup copy has won
+            release.wait(timeout=10)
+            straggler_done.set()
+            return 'stale'
+        time.sleep(0.01)
+        return f'{task}@{worker.id}'
+
+    scheduler = TaskScheduler(workers, speculative=True, slow_task_factor=2)
+    placement, errors = scheduler.run(['slow', 't1', 't2'], run_task)
+
+    assert errors == {}
+    assert placement['slow'] == (b, 'slow@b')
+    assert scheduler.stats['speculative_attempts'] == 1
+    assert scheduler.stats['speculative_wins'] == 1
+
+    release.set()
+    assert straggler_done.wait(timeout=5)
+    # Give the abandoned attempt time to report back
+    time.sleep(0.1)
+    assert placement['slow'] == (b, 'slow@b')
+
+def test_task_that_fails_every_attempt_is_reported(workers):
+    def run_task(task, worker):
+        raise ValueError(f'bad input on {worker.id}')
+
+    scheduler = TaskScheduler(workers, max_attempts=3, max_worker_failures=10)
+    placement, errors = scheduler.run(['t0'], run_task)
+
+    assert placement == {}
+    assert isinstance(errors['t0'], ValueError)
+    assert scheduler.stats['attempts'] == 3
+    assert scheduler.stats['retries'] == 2